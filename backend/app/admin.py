@@ -0,0 +1,20 @@
+"""
+Guard for maintenance endpoints (bulk import/export and similar).
+
+They are disabled unless ADMIN_TOKEN is set, and then require the same
+value in the X-Admin-Token header.
+"""
+import hmac
+import os
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API is disabled: ADMIN_TOKEN is not set")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
@@ -0,0 +1,337 @@
+"""
+AI challenge generation.
+
+Requests are served from a pool of pre-generated challenges per
+(difficulty, category) pair; the pool is refilled in the background so the
+LLM round trip is almost never on the request path. Pools live in an LRU
+cache, so free-form categories cannot grow memory without bound.
+
+Set OPENAI_BASE_URL to point the client at a local stub of the OpenAI API.
+The openai package is imported on first use, so it costs nothing at boot
+when no API key is configured.
+"""
+import asyncio
+from collections import OrderedDict, deque
+import json
+import os
+import random
+import time
+from typing import Optional
+
+AI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+AI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "15"))
+AI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "1"))
+# Pre-generated challenges kept per (difficulty, category)
+AI_POOL_SIZE = int(os.getenv("AI_POOL_SIZE", "5"))
+# Number of (difficulty, category) pools kept before the least recently used is evicted
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "64"))
+# How long the last generated challenge may be repeated while a pool refills
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "300"))
+# Concurrent LLM calls made by batch generation, shared by all batches
+AI_BATCH_CONCURRENCY = int(os.getenv("AI_BATCH_CONCURRENCY", "4"))
+
+DIFFICULTIES = ("easy", "medium", "hard", "extreme")
+DEFAULT_DIFFICULTY = "medium"
+DEFAULT_CATEGORY = "general"
+
+# Fallback challenges if OpenAI is not configured or fails
+FALLBACK_CHALLENGES = (
+    {
+        "title": "Read a book for 30 minutes daily",
+        "description": "Dedicate 30 minutes each day to reading. Choose any book you like and track your progress.",
+        "difficulty": "easy",
+        "stars": 3,
+    },
+    {
+        "title": "Learn a new skill online",
+        "description": "Take an online course or watch tutorials to learn something new. Complete at least one module per day.",
+        "difficulty": "medium",
+        "stars": 5,
+    },
+    {
+        "title": "30-day fitness challenge",
+        "description": "Exercise for at least 45 minutes daily. Mix cardio, strength training, and flexibility exercises.",
+        "difficulty": "hard",
+        "stars": 8,
+    },
+    {
+        "title": "Digital detox weekend",
+        "description": "Spend an entire weekend without using social media or unnecessary digital devices.",
+        "difficulty": "medium",
+        "stars": 5,
+    },
+    {
+        "title": "Cook a new recipe every day",
+        "description": "Challenge yourself to cook a different recipe each day. Try cuisines you've never attempted before.",
+        "difficulty": "hard",
+        "stars": 7,
+    },
+    {
+        "title": "Meditation and mindfulness",
+        "description": "Practice meditation for 15 minutes every morning. Focus on breathing and mindfulness techniques.",
+        "difficulty": "easy",
+        "stars": 3,
+    },
+    {
+        "title": "No sugar challenge",
+        "description": "Avoid all added sugars and sugary foods for 7 days. Read labels carefully and choose natural alternatives.",
+        "difficulty": "medium",
+        "stars": 5,
+    },
+    {
+        "title": "Morning routine mastery",
+        "description": "Wake up at the same time every day and complete a 1-hour morning routine including exercise, planning, and self-care.",
+        "difficulty": "hard",
+        "stars": 8,
+    },
+)
+
+FALLBACK_BY_DIFFICULTY = {
+    difficulty: tuple(c for c in FALLBACK_CHALLENGES if c["difficulty"] == difficulty)
+    for difficulty in DIFFICULTIES
+}
+
+PROMPT_TEMPLATE = """Generate a creative and engaging personal challenge.
+
+Requirements:
+- Difficulty level: {difficulty}
+- Category: {category}
+- The challenge should be specific, measurable, and achievable
+- Make it inspiring and motivating
+- Return ONLY a JSON object with these exact fields: title, description, difficulty, stars
+
+Example format:
+{{
+    "title": "30-Day Fitness Challenge",
+    "description": "Exercise for at least 45 minutes daily. Mix cardio, strength training, and flexibility exercises.",
+    "difficulty": "hard",
+    "stars": 8
+}}
+
+Generate the challenge now:"""
+
+
+def get_stars_by_difficulty(difficulty: str) -> int:
+    """Map difficulty to stars"""
+    mapping = {
+        "easy": 3,
+        "medium": 5,
+        "hard": 8,
+        "extreme": 10
+    }
+    return mapping.get(difficulty, 5)
+
+
+def fallback_challenge(difficulty: Optional[str] = None) -> dict:
+    """Pick a predefined challenge, matching the difficulty when possible"""
+    candidates = FALLBACK_BY_DIFFICULTY.get(difficulty) or FALLBACK_CHALLENGES
+    return dict(random.choice(candidates))
+
+
+def parse_challenge(content: str, difficulty: str) -> dict:
+    """Extract the challenge JSON from an LLM reply
+
+    Raises ValueError when the reply is not a challenge.
+    """
+    content = content.strip()
+    if content.startswith("```json"):
+        content = content.replace("```json", "").replace("```", "").strip()
+    elif content.startswith("```"):
+        content = content.replace("```", "").strip()
+
+    data = json.loads(content)
+    if not isinstance(data, dict):
+        raise ValueError("reply is not a JSON object")
+    for field in ("title", "description"):
+        if not isinstance(data.get(field), str) or not data[field].strip():
+            raise ValueError(f"reply has no {field} string")
+
+    # Ensure stars match difficulty
+    if data.get("difficulty") in DIFFICULTIES:
+        difficulty = data["difficulty"]
+    return {
+        "title": data["title"],
+        "description": data["description"],
+        "difficulty": difficulty,
+        "stars": get_stars_by_difficulty(difficulty),
+    }
+
+
+class ChallengePool:
+    """Pre-generated challenges for one (difficulty, category) pair"""
+
+    def __init__(self):
+        self.items = deque()
+        self.last: Optional[dict] = None
+        self.last_at = 0.0
+        self.refill_task: Optional[asyncio.Task] = None
+        # Set while items is not empty
+        self.filled = asyncio.Event()
+
+    async def wait_filled(self, timeout: float):
+        """Wait for the running refill to add a challenge, or to give up"""
+        if self.refill_task is None:
+            return
+        waiter = asyncio.ensure_future(self.filled.wait())
+        try:
+            await asyncio.wait({waiter, self.refill_task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+
+    def pop(self) -> dict:
+        challenge = self.items.popleft()
+        if not self.items:
+            self.filled.clear()
+        self.remember(challenge)
+        return challenge
+
+    def recent(self) -> Optional[dict]:
+        if self.last is not None and time.monotonic() - self.last_at < AI_CACHE_TTL:
+            return self.last
+        return None
+
+    def remember(self, challenge: dict):
+        self.last = challenge
+        self.last_at = time.monotonic()
+
+
+class ChallengeGenerator:
+    def __init__(self, pool_size: int = AI_POOL_SIZE, cache_size: int = AI_CACHE_SIZE):
+        self.pool_size = pool_size
+        self.cache_size = cache_size
+        self._client = None
+        self._pools: "OrderedDict[tuple, ChallengePool]" = OrderedDict()
+        self._batch_semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def client(self):
+        """OpenAI client, created on first use; None if no API key is set"""
+        if self._client is None:
+            api_key = os.getenv("OPENAI_API_KEY")
+            if api_key:
+                from openai import AsyncOpenAI
+                self._client = AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=os.getenv("OPENAI_BASE_URL") or None,
+                    timeout=AI_TIMEOUT,
+                    max_retries=AI_MAX_RETRIES,
+                )
+        return self._client
+
+    async def generate(self, difficulty: str, category: str) -> dict:
+        """Ask the LLM for a new challenge; raises on any failure"""
+        response = await self.client.chat.completions.create(
+            model=AI_MODEL,
+            messages=[
+                {"role": "system", "content": "You are a creative challenge generator. Always respond with valid JSON only."},
+                {"role": "user", "content": PROMPT_TEMPLATE.format(difficulty=difficulty, category=category)}
+            ],
+            temperature=0.8,
+            max_tokens=200
+        )
+        return parse_challenge(response.choices[0].message.content, difficulty)
+
+    def _pool(self, key: tuple) -> ChallengePool:
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = ChallengePool()
+            while len(self._pools) > self.cache_size:
+                _, evicted = self._pools.popitem(last=False)
+                if evicted.refill_task:
+                    evicted.refill_task.cancel()
+        else:
+            self._pools.move_to_end(key)
+        return pool
+
+    def _schedule_refill(self, key: tuple, pool: ChallengePool):
+        if pool.refill_task is None or pool.refill_task.done():
+            pool.refill_task = asyncio.create_task(self._refill(key, pool))
+
+    async def _refill(self, key: tuple, pool: ChallengePool):
+        difficulty, category = key
+        while len(pool.items) < self.pool_size:
+            try:
+                challenge = await self.generate(difficulty, category)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Не удалось сгенерировать челлендж для пула {key}: {e}")
+                return
+            pool.items.append(challenge)
+            pool.filled.set()
+
+    async def get(self, difficulty: Optional[str] = None, category: Optional[str] = None) -> dict:
+        """Return a challenge, from the pool when possible"""
+        if not self.client:
+            return fallback_challenge(difficulty)
+
+        key = (difficulty or DEFAULT_DIFFICULTY, category or DEFAULT_CATEGORY)
+        pool = self._pool(key)
+
+        if len(pool.items) <= self.pool_size // 2:
+            self._schedule_refill(key, pool)
+        if pool.items:
+            return pool.pop()
+
+        # Pool is empty: repeat a recent challenge rather than wait on the LLM
+        recent = pool.recent()
+        if recent is not None:
+            return recent
+
+        # Take the first challenge of the refill started above instead of
+        # paying for a second LLM call
+        await pool.wait_filled(AI_TIMEOUT)
+        if pool.items:
+            return pool.pop()
+        # Another request took it
+        return pool.recent() or fallback_challenge(difficulty)
+
+    async def generate_many(self, specs):
+        """Generate one fresh challenge per (difficulty, category) spec
+
+        Yields (index, challenge, error) tuples in completion order. Calls
+        run concurrently, limited by AI_BATCH_CONCURRENCY across batches.
+        """
+        if self._batch_semaphore is None:
+            self._batch_semaphore = asyncio.Semaphore(AI_BATCH_CONCURRENCY)
+
+        async def run(index, difficulty, category):
+            if not self.client:
+                return index, fallback_challenge(difficulty), None
+            async with self._batch_semaphore:
+                try:
+                    return index, await self.generate(difficulty or DEFAULT_DIFFICULTY, category or DEFAULT_CATEGORY), None
+                except Exception as e:
+                    return index, None, str(e) or type(e).__name__
+
+        tasks = [
+            asyncio.create_task(run(index, difficulty, category))
+            for index, (difficulty, category) in enumerate(specs)
+        ]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            # Client went away mid-stream
+            for task in tasks:
+                task.cancel()
+
+    def warm_up(self, category: str = DEFAULT_CATEGORY):
+        """Start filling the pools of every difficulty in the background"""
+        if not self.client:
+            return
+        for difficulty in DIFFICULTIES:
+            key = (difficulty, category)
+            self._schedule_refill(key, self._pool(key))
+
+    async def close(self):
+        tasks = [pool.refill_task for pool in self._pools.values() if pool.refill_task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+challenge_generator = ChallengeGenerator()
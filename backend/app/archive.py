@@ -0,0 +1,177 @@
+"""
+Expiry and archival of challenges past their deadline.
+
+The feed hides expired challenges as soon as their deadline passes. After
+CHALLENGE_ARCHIVE_GRACE_HOURS a background job moves each expired challenge
+and its user_challenges rows into archived_challenges and
+archived_user_challenges in one transaction. From then on the challenge
+is closed: its stats are frozen and toggles return 404. User counters
+are lifetime totals and are not changed.
+
+Every worker runs the job; rows are moved with INSERT ... ON CONFLICT and
+DELETE, so workers racing on the same challenge do no harm.
+Run it once by hand (or from cron with CHALLENGE_EXPIRY_INTERVAL=0):
+
+    python -m app.archive
+"""
+import asyncio
+from datetime import datetime, timedelta
+import os
+from typing import Optional
+
+from sqlalchemy import delete, func, select
+
+from app.bus import invalidation_bus, publish_changes
+from app.cache import response_cache
+from app.database import AsyncSessionLocal, async_engine, dialect_insert
+from app.models import ArchivedChallenge, ArchivedUserChallenge, Challenge, UserChallenge
+
+# Seconds between expiry scans, 0 disables the background job
+CHALLENGE_EXPIRY_INTERVAL = float(os.getenv("CHALLENGE_EXPIRY_INTERVAL", "60"))
+# How long expired challenges stay in the live tables before they are archived
+CHALLENGE_ARCHIVE_GRACE_HOURS = float(os.getenv("CHALLENGE_ARCHIVE_GRACE_HOURS", "24"))
+# Challenges moved per transaction
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+
+
+def live_filter(now: Optional[datetime] = None):
+    """WHERE clause for challenges whose deadline has not passed"""
+    return Challenge.deadline > (now or datetime.now())
+
+
+def _columns(model, names):
+    return [model.__table__.c[name] for name in names]
+
+
+async def archive_batch(db, challenge_ids) -> int:
+    """Move the given challenges and their progress rows to the archive
+
+    A challenge id archived before (seed challenges are recreated by
+    init_data) replaces the earlier archived row, so the archive keeps
+    its latest stats. Earlier progress rows stay archived.
+    """
+    challenge_names = [c.name for c in Challenge.__table__.columns]
+    progress_names = [c.name for c in UserChallenge.__table__.columns]
+
+    rearchived = (await db.execute(
+        select(ArchivedChallenge.id).where(ArchivedChallenge.id.in_(challenge_ids))
+    )).scalars().all()
+    if rearchived:
+        print(f"Повторная архивация, прежние записи заменены: {', '.join(sorted(rearchived))}")
+    statement = dialect_insert(db, ArchivedChallenge).from_select(
+        challenge_names, select(*_columns(Challenge, challenge_names)).where(Challenge.id.in_(challenge_ids))
+    )
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=["id"],
+        set_={
+            **{name: statement.excluded[name] for name in challenge_names if name != "id"},
+            "archived_at": func.now(),
+        }
+    ))
+
+    progress = select(*_columns(UserChallenge, progress_names)).where(UserChallenge.challenge_id.in_(challenge_ids))
+    expected = await db.scalar(select(func.count()).select_from(progress.subquery()))
+    moved = (await db.execute(
+        dialect_insert(db, ArchivedUserChallenge)
+        .from_select(progress_names, progress)
+        .on_conflict_do_nothing()
+        .returning(ArchivedUserChallenge.id)
+    )).all()
+    if len(moved) < expected:
+        # Ids already archived: SQLite reuses the ids of deleted rows
+        print(f"Не архивировано строк прогресса с занятым id: {expected - len(moved)}")
+    await db.execute(
+        delete(UserChallenge)
+        .where(UserChallenge.challenge_id.in_(challenge_ids))
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(
+        delete(Challenge)
+        .where(Challenge.id.in_(challenge_ids))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount
+
+
+async def archive_expired(now: Optional[datetime] = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Archive every challenge whose grace period is over; returns the count"""
+    cutoff = (now or datetime.now()) - timedelta(hours=CHALLENGE_ARCHIVE_GRACE_HOURS)
+    archived = 0
+    async with AsyncSessionLocal() as db:
+        while True:
+            challenge_ids = (await db.execute(
+                select(Challenge.id)
+                .where(Challenge.deadline <= cutoff)
+                .order_by(Challenge.deadline)
+                .limit(batch_size)
+            )).scalars().all()
+            if not challenge_ids:
+                break
+            archived += await archive_batch(db, challenge_ids)
+            if len(challenge_ids) < batch_size:
+                break
+
+    if archived:
+        publish_changes(paths=["/api/challenges"])
+        print(f"Архивировано челленджей: {archived}")
+    return archived
+
+
+async def any_expired_between(since: datetime, until: datetime) -> bool:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(
+            select(Challenge.id).where(Challenge.deadline > since, Challenge.deadline <= until).limit(1)
+        )).first() is not None
+
+
+class ExpiryScheduler:
+    def __init__(self, interval: float = CHALLENGE_EXPIRY_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        last_scan = datetime.now()
+        while True:
+            try:
+                now = datetime.now()
+                # Cached feeds still list challenges that expired since the last
+                # scan; every worker checks this itself
+                if await any_expired_between(last_scan, now):
+                    response_cache.invalidate("/api/challenges")
+                last_scan = now
+                await archive_expired(now)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Не удалось архивировать челленджи: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+expiry_scheduler = ExpiryScheduler()
+
+
+async def _run_once():
+    # Tell running workers to drop their cached feeds
+    await invalidation_bus.start()
+    await archive_expired()
+    await invalidation_bus.close()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_run_once())
@@ -0,0 +1,148 @@
+"""
+Fingerprinted, precompressed frontend assets.
+
+The build step copies frontend/js and frontend/css into frontend/dist
+under content-hashed names (app.3f2a9c1d.js). It writes gzip and brotli
+copies next to each file and a manifest.json mapping source paths to
+built ones. Run it once per build:
+
+    python -m app.assets
+
+At startup AssetFiles loads the built files into memory and serves them
+under /assets with immutable cache headers, picking the precompressed
+variant the client accepts. index.html is rewritten to the fingerprinted
+URLs and also served precompressed, with an ETag and Cache-Control:
+no-cache. Repeat visits cost a 304 for the page and nothing for assets.
+Without a build, the plain /static files are served as before.
+"""
+import hashlib
+import json
+import mimetypes
+from pathlib import Path
+import shutil
+import sys
+from typing import Dict, Optional
+
+from app.cache import make_etag
+from app.compression import ENCODINGS, compress, request_encoding
+
+ASSET_DIRS = ("js", "css")
+DIST_DIR = "dist"
+MANIFEST = "manifest.json"
+IMMUTABLE = b"public, max-age=31536000, immutable"
+
+
+def build(frontend_path: Path) -> Dict[str, str]:
+    """Write fingerprinted, precompressed copies of the frontend assets"""
+    dist = frontend_path / DIST_DIR
+    if dist.exists():
+        shutil.rmtree(dist)
+    manifest = {}
+    for directory in ASSET_DIRS:
+        for source in sorted((frontend_path / directory).glob("*.*")):
+            content = source.read_bytes()
+            digest = hashlib.blake2b(content, digest_size=4).hexdigest()
+            built = f"{directory}/{source.stem}.{digest}{source.suffix}"
+            target = dist / built
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(content)
+            for encoding in ENCODINGS:
+                suffix = ".br" if encoding == "br" else ".gz"
+                target.with_name(target.name + suffix).write_bytes(compress(content, encoding, best=True))
+            manifest[f"{directory}/{source.name}"] = built
+    (dist / MANIFEST).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return manifest
+
+
+class Variants:
+    """One resource in every available encoding"""
+
+    def __init__(self, content: bytes, media_type: str, cache_control: bytes, variants: Optional[dict] = None):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.variants = {"identity": content}
+        self.variants.update(variants or {})
+        self.etags = {encoding: make_etag(body) for encoding, body in self.variants.items()}
+
+    @classmethod
+    def compressed(cls, content: bytes, media_type: str, cache_control: bytes):
+        return cls(content, media_type, cache_control, {e: compress(content, e, best=True) for e in ENCODINGS})
+
+    async def __call__(self, scope, receive, send):
+        await self.send(scope, send)
+
+    async def send(self, scope, send):
+        encoding = request_encoding(scope)
+        if encoding not in self.variants:
+            encoding = "identity"
+        body, etag = self.variants[encoding], self.etags[encoding]
+        headers = [
+            (b"content-type", self.media_type.encode()),
+            (b"cache-control", self.cache_control),
+            (b"etag", etag),
+            (b"vary", b"Accept-Encoding"),
+        ]
+        if encoding != "identity":
+            headers.append((b"content-encoding", encoding.encode()))
+
+        if_none_match = next((v for k, v in scope["headers"] if k == b"if-none-match"), None)
+        if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(b",")]:
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": b"" if scope["method"] == "HEAD" else body})
+
+
+class AssetFiles:
+    """ASGI app serving the built assets from memory"""
+
+    def __init__(self, dist: Path):
+        self.manifest: Dict[str, str] = json.loads((dist / MANIFEST).read_text())
+        self.files: Dict[str, Variants] = {}
+        for built in self.manifest.values():
+            path = dist / built
+            variants = {}
+            for encoding in ENCODINGS:
+                compressed = path.with_name(path.name + (".br" if encoding == "br" else ".gz"))
+                if compressed.exists():
+                    variants[encoding] = compressed.read_bytes()
+            media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            if media_type.startswith("text/") or media_type == "application/javascript":
+                media_type += "; charset=utf-8"
+            self.files["/" + built] = Variants(path.read_bytes(), media_type, IMMUTABLE, variants)
+
+    def rewrite(self, html: bytes, static_prefix: str = "/static/", assets_prefix: str = "/assets/") -> bytes:
+        """Point index.html at the fingerprinted files"""
+        for source, built in self.manifest.items():
+            html = html.replace(f'"{static_prefix}{source}"'.encode(), f'"{assets_prefix}{built}"'.encode())
+        return html
+
+    async def __call__(self, scope, receive, send):
+        # Mounted under /assets: the mount prefix is in root_path
+        path = scope["path"][len(scope.get("root_path", "")):]
+        asset = self.files.get(path) if scope["method"] in ("GET", "HEAD") else None
+        if asset is None:
+            await send({"type": "http.response.start", "status": 404, "headers": [(b"content-type", b"text/plain")]})
+            await send({"type": "http.response.body", "body": b"Not Found"})
+            return
+        await asset.send(scope, send)
+
+
+def load(frontend_path: Path) -> Optional[AssetFiles]:
+    dist = frontend_path / DIST_DIR
+    if not (dist / MANIFEST).exists():
+        return None
+    return AssetFiles(dist)
+
+
+if __name__ == "__main__":
+    frontend = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).parent.parent.parent / "frontend"
+    if not frontend.exists():
+        frontend = Path(__file__).parent.parent / "frontend"
+    if not frontend.exists():
+        print(f"Фронтенд не найден: {frontend}")
+        sys.exit(0)
+    built = build(frontend)
+    print(f"Собрано ассетов: {len(built)} в {frontend / DIST_DIR}")
@@ -0,0 +1,360 @@
+"""
+Cross-worker invalidation bus.
+
+Every uvicorn worker keeps its own response cache, rank index and SSE
+subscribers. Writes go through publish_changes, which applies the change
+locally and sends it to the other workers as a small JSON event. They
+apply it to their own caches. Nothing polls the database.
+
+Transports, chosen by INVALIDATION_BUS:
+
+- postgres: LISTEN/NOTIFY on INVALIDATION_CHANNEL over one dedicated
+  asyncpg connection per worker. Default with a Postgres DATABASE_URL;
+  works across containers.
+- local: one Unix datagram socket per worker in INVALIDATION_BUS_PATH,
+  for several workers on one host (SQLite, tests). Default otherwise.
+- off: changes stay in the worker that made them.
+
+Events carry absolute values (a user's score, a challenge's counters),
+so applying one twice is harmless. A worker that lost its LISTEN
+connection may have missed events: once reconnected it drops its
+response cache and rebuilds the rank index.
+"""
+import asyncio
+import glob
+import os
+import socket
+import uuid
+from typing import Callable, Iterable, List, Optional
+
+import orjson
+from sqlalchemy.engine import make_url
+
+from app.cache import response_cache
+from app.database import SQLALCHEMY_DATABASE_URL
+from app.events import broadcaster
+from app.rank_index import load_rank_index, rank_index
+from app.replicas import replica_router
+
+INVALIDATION_BUS = os.getenv("INVALIDATION_BUS", "auto")  # auto, postgres, local, off
+INVALIDATION_CHANNEL = os.getenv("INVALIDATION_CHANNEL", "winplacearena_changes")
+INVALIDATION_BUS_PATH = os.getenv("INVALIDATION_BUS_PATH", "./invalidation-bus")
+
+# NOTIFY payloads must stay below 8000 bytes; larger events are split
+MAX_PAYLOAD = 7500
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+# How often an idle LISTEN connection is checked
+KEEPALIVE_INTERVAL = 30.0
+# Give up on a local peer whose socket stays full this long
+SEND_TIMEOUT = 1.0
+# Time close() waits for queued events to go out
+DRAIN_TIMEOUT = 2.0
+
+LIST_FIELDS = ("paths", "users", "challenges", "sticky")
+
+
+def apply_changes(event: dict):
+    """Apply a change event to this worker's cache, rank index and live events"""
+    if event.get("clear"):
+        response_cache.clear()
+    elif event.get("paths"):
+        response_cache.invalidate(*event["paths"])
+    for user_id, name, completed_challenges in event.get("users", ()):
+        rank_index.set(user_id, name, completed_challenges)
+        broadcaster.publish_user(user_id, completed_challenges)
+    for challenge_id, participants_count, completed_count in event.get("challenges", ()):
+        broadcaster.publish_challenge(challenge_id, participants_count, completed_count)
+    replica_router.stick(event.get("sticky", ()))
+
+
+def publish_changes(paths: Iterable[str] = (), users: Iterable = (), challenges: Iterable = (),
+                    sticky: Iterable[str] = (), clear: bool = False):
+    """Apply a committed write here and on every other worker
+
+    paths are response cache prefixes to invalidate, users are
+    (id, name, completed_challenges) rows and challenges are
+    (id, participants_count, completed_count) rows of global challenges.
+    sticky user ids read from the primary for a while (app.replicas).
+    clear drops the whole response cache.
+    """
+    event = {}
+    if clear:
+        event["clear"] = True
+    for field, values in zip(LIST_FIELDS, (paths, users, challenges, sticky)):
+        values = [value if isinstance(value, str) else list(value) for value in values]
+        if values:
+            event[field] = values
+    if not event:
+        return
+    apply_changes(event)
+    invalidation_bus.publish(event)
+
+
+def _split(event: dict) -> List[dict]:
+    """Halve the lists of an event"""
+    halves = ({**event}, {**event})
+    for field in LIST_FIELDS:
+        values = event.get(field)
+        if values and len(values) > 1:
+            middle = len(values) // 2
+            halves[0][field], halves[1][field] = values[:middle], values[middle:]
+    return list(halves)
+
+
+def _asyncpg_dsn(url: str) -> str:
+    # asyncpg reads libpq's sslmode from the DSN itself
+    return make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+class PostgresTransport:
+    """LISTEN/NOTIFY over one dedicated asyncpg connection"""
+
+    def __init__(self, on_message: Callable[[bytes], None], on_resync, dsn: Optional[str] = None,
+                 channel: str = INVALIDATION_CHANNEL):
+        self.on_message = on_message
+        self.on_resync = on_resync
+        self.dsn = dsn or _asyncpg_dsn(SQLALCHEMY_DATABASE_URL)
+        self.channel = channel
+        self._connection = None
+        self._connected = asyncio.Event()
+        # asyncpg runs one query per connection at a time
+        self._lock = asyncio.Lock()
+        self._lost: Optional[asyncio.Future] = None
+        self._supervisor: Optional[asyncio.Task] = None
+
+    async def _connect(self):
+        import asyncpg
+
+        connection = await asyncpg.connect(self.dsn)
+        lost = asyncio.get_running_loop().create_future()
+        connection.add_termination_listener(lambda _: lost.done() or lost.set_result(None))
+        await connection.add_listener(self.channel, self._notify)
+        self._connection, self._lost = connection, lost
+        self._connected.set()
+
+    def _notify(self, connection, pid, channel, payload):
+        self.on_message(payload.encode())
+
+    async def start(self):
+        # The first connection is made before the rank index is loaded,
+        # so no event can fall between the two
+        await self._connect()
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def _supervise(self):
+        while True:
+            await self._watch()
+            self._connected.clear()
+            self._connection = None
+            print("Шина инвалидации: соединение LISTEN потеряно, переподключение")
+            delay = RECONNECT_DELAY
+            while True:
+                try:
+                    await self._connect()
+                    break
+                except Exception as e:
+                    print(f"Шина инвалидации: не удалось подключиться: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            try:
+                await self.on_resync()
+            except Exception as e:
+                print(f"Шина инвалидации: не удалось обновить кэши: {e}")
+
+    async def _watch(self):
+        """Return once the connection is gone"""
+        while True:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._lost), KEEPALIVE_INTERVAL)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                async with self._lock:
+                    await self._connection.fetchval("SELECT 1", timeout=KEEPALIVE_INTERVAL)
+            except Exception:
+                self._connection.terminate()
+                return
+
+    async def send(self, payload: bytes):
+        await self._connected.wait()
+        async with self._lock:
+            await self._connection.execute("SELECT pg_notify($1, $2)", self.channel, payload.decode())
+
+    async def close(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                pass
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+
+class LocalTransport:
+    """Unix datagram sockets, one per worker, in a shared directory"""
+
+    def __init__(self, on_message: Callable[[bytes], None], on_resync, directory: str = INVALIDATION_BUS_PATH):
+        self.on_message = on_message
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}.sock")
+        self._socket: Optional[socket.socket] = None
+        self._loop = None
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.path)
+        self._socket.setblocking(False)
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._socket.fileno(), self._read)
+
+    def _read(self):
+        while True:
+            try:
+                payload = self._socket.recv(65536)
+            except BlockingIOError:
+                return
+            self.on_message(payload)
+
+    async def send(self, payload: bytes):
+        for peer in glob.glob(os.path.join(self.directory, "*.sock")):
+            if peer == self.path:
+                continue
+            try:
+                await asyncio.wait_for(self._loop.sock_sendto(self._socket, payload, peer), SEND_TIMEOUT)
+            except ConnectionRefusedError:
+                # Nothing is bound to the socket: its worker is gone
+                try:
+                    os.unlink(peer)
+                except FileNotFoundError:
+                    pass
+            except FileNotFoundError:
+                pass
+            except asyncio.TimeoutError:
+                print(f"Шина инвалидации: воркер {peer} не принимает события")
+
+    async def close(self):
+        if self._socket is None:
+            return
+        self._loop.remove_reader(self._socket.fileno())
+        self._socket.close()
+        self._socket = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class InvalidationBus:
+    def __init__(self, mode: str = INVALIDATION_BUS):
+        if mode == "auto":
+            if make_url(SQLALCHEMY_DATABASE_URL).get_backend_name() == "postgresql":
+                mode = "postgres"
+            else:
+                # No datagram Unix sockets on Windows
+                mode = "local" if hasattr(socket, "AF_UNIX") and os.name != "nt" else "off"
+        self.mode = mode
+        self.origin = uuid.uuid4().hex[:12]
+        self.sent = 0
+        self.received = 0
+        self._transport = None
+        self._outbox: Optional[asyncio.Queue] = None
+        self._sender: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._transport is not None
+
+    async def start(self):
+        if self.mode == "off" or self.running:
+            return
+        transport_class = PostgresTransport if self.mode == "postgres" else LocalTransport
+        transport = transport_class(self._receive, self._resync)
+        await transport.start()
+        self._transport = transport
+        self._outbox = asyncio.Queue()
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def publish(self, event: dict):
+        """Queue an event for the other workers; no-op until started"""
+        if not self.running:
+            return
+        pending = [event]
+        while pending:
+            part = pending.pop()
+            payload = orjson.dumps({"origin": self.origin, **part})
+            if len(payload) <= MAX_PAYLOAD:
+                self._outbox.put_nowait(payload)
+            elif any(len(part.get(field, ())) > 1 for field in LIST_FIELDS):
+                pending.extend(reversed(_split(part)))
+            else:
+                # A single oversized entry: have the others drop everything
+                self._outbox.put_nowait(orjson.dumps({"origin": self.origin, "clear": True}))
+
+    def _receive(self, payload: bytes):
+        try:
+            event = orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            return
+        if not isinstance(event, dict) or event.pop("origin", None) == self.origin:
+            return
+        self.received += 1
+        try:
+            apply_changes(event)
+        except Exception as e:
+            print(f"Шина инвалидации: не удалось применить событие: {e}")
+
+    async def _resync(self):
+        """Catch up after events may have been missed"""
+        response_cache.clear()
+        await asyncio.to_thread(load_rank_index)
+
+    async def _send_loop(self):
+        while True:
+            payload = await self._outbox.get()
+            delay = RECONNECT_DELAY
+            while True:
+                try:
+                    await self._transport.send(payload)
+                    self.sent += 1
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Шина инвалидации: не удалось отправить событие: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            self._outbox.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "running": self.running,
+            "sent": self.sent,
+            "received": self.received,
+            "queued": self._outbox.qsize() if self._outbox else 0,
+        }
+
+    async def close(self):
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._outbox.join(), DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Шина инвалидации: не отправлено событий: {self._outbox.qsize()}")
+        self._sender.cancel()
+        try:
+            await self._sender
+        except asyncio.CancelledError:
+            pass
+        await self._transport.close()
+        self._transport = self._outbox = self._sender = None
+
+
+invalidation_bus = InvalidationBus()
@@ -0,0 +1,156 @@
+"""
+Server-side response cache with strong ETags for read-heavy GET endpoints.
+
+Successful GET responses under CACHED_PREFIXES are stored by path, query
+string and negotiated Content-Encoding. Routers invalidate the affected
+paths after every write, and clients that send a matching If-None-Match
+get an empty 304.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+from app.compression import request_encoding
+
+CACHED_PREFIXES = ("/api/challenges", "/api/leaderboard", "/api/users")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+
+CacheEntry = Tuple[list, bytes, bytes]  # headers, body, etag
+
+# Scope key set by handlers whose data may be up to this many seconds old
+# (read replicas); such responses are not stored right after a write
+READ_LAG_SCOPE_KEY = "read_lag_bound"
+
+
+def make_etag(body: bytes) -> bytes:
+    return b'"' + hashlib.blake2b(body, digest_size=16).hexdigest().encode() + b'"'
+
+
+def _matches(path: str, prefix: str) -> bool:
+    return path == prefix or path.startswith(prefix.rstrip("/") + "/")
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, bytes, str], CacheEntry]" = OrderedDict()
+        # Bumped on every invalidation so responses computed before a write
+        # are never stored after it
+        self.generation = 0
+        self.invalidated_at = 0.0
+
+    def get(self, key) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry: CacheEntry, generation: int):
+        with self._lock:
+            if generation != self.generation or self.max_entries <= 0:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *prefixes: str):
+        """Drop cached responses whose path equals or is below any prefix"""
+        with self._lock:
+            self.generation += 1
+            self.invalidated_at = time.monotonic()
+            stale = [key for key in self._entries if any(_matches(key[0], p) for p in prefixes)]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.invalidated_at = time.monotonic()
+            self._entries.clear()
+
+
+response_cache = ResponseCache()
+
+
+class ResponseCacheMiddleware:
+    """ASGI middleware serving cached GET responses and 304 revalidations"""
+
+    def __init__(self, app, cache: ResponseCache = response_cache, prefixes=CACHED_PREFIXES):
+        self.app = app
+        self.cache = cache
+        self.prefixes = prefixes
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or not any(_matches(scope["path"], p) for p in self.prefixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        # Compressed bodies are cached, so each encoding is its own entry
+        key = (scope["path"], scope["query_string"], request_encoding(scope))
+        if_none_match = None
+        for name, value in scope["headers"]:
+            if name == b"if-none-match":
+                if_none_match = value
+                break
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            await self._send(send, entry, if_none_match)
+            return
+
+        # Buffer the response so the ETag can go into its headers
+        generation = self.cache.generation
+        start = None
+        chunks = []
+
+        async def capture(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, capture)
+
+        body = b"".join(chunks)
+        # Handlers opt out with Cache-Control: no-store (answers that depend on the date)
+        if (b"cache-control", b"no-store") in start["headers"]:
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+            return
+        headers = [(k, v) for k, v in start["headers"] if k not in (b"etag", b"cache-control")]
+        if start["status"] != 200:
+            await send({"type": "http.response.start", "status": start["status"], "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        # no-cache: browsers may keep the body but must revalidate with the ETag
+        etag = make_etag(body)
+        headers += [(b"etag", etag), (b"cache-control", b"no-cache")]
+        entry = (headers, body, etag)
+        # A lagging read may predate the last write: serve it, but do not keep it
+        lag_bound = scope.get(READ_LAG_SCOPE_KEY)
+        if not lag_bound or time.monotonic() - self.cache.invalidated_at >= lag_bound:
+            self.cache.set(key, entry, generation)
+        await self._send(send, entry, if_none_match)
+
+    @staticmethod
+    async def _send(send, entry: CacheEntry, if_none_match: Optional[bytes]):
+        headers, body, etag = entry
+        if if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(b",")]:
+            not_modified = [(k, v) for k, v in headers if k != b"content-length"]
+            await send({"type": "http.response.start", "status": 304, "headers": not_modified})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
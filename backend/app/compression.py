@@ -0,0 +1,125 @@
+"""
+Content-Encoding negotiation and compression of API responses.
+
+CompressionMiddleware compresses complete responses of at least
+COMPRESS_MIN_BYTES with brotli or gzip, whichever the client prefers.
+Only responses with a Content-Length are touched. Streams (NDJSON
+exports, Server-Sent Events) pass through unbuffered. The response cache
+keys entries by negotiated encoding, so a cached response is compressed
+only once.
+
+brotli is optional: without it only gzip is offered.
+"""
+import gzip
+import os
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+# Fast levels for per-response compression; static assets use the maximum
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+COMPRESSIBLE_TYPES = (b"application/json", b"text/", b"application/javascript", b"application/x-ndjson", b"image/svg+xml")
+
+
+def negotiate(accept_encoding: Optional[bytes]) -> str:
+    """Pick the best encoding the client accepts: br, gzip or identity"""
+    if not accept_encoding:
+        return "identity"
+    accepted = {}
+    for part in accept_encoding.decode("latin-1").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return "identity"
+
+
+def request_encoding(scope) -> str:
+    for name, value in scope["headers"]:
+        if name == b"accept-encoding":
+            return negotiate(value)
+    return "identity"
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else BROTLI_QUALITY)
+    if encoding == "gzip":
+        # mtime=0 keeps the output, and so the ETag, stable
+        return gzip.compress(body, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+    return body
+
+
+def _vary(headers: list) -> list:
+    for index, (name, value) in enumerate(headers):
+        if name == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[index] = (name, value + b", Accept-Encoding")
+            return headers
+    return headers + [(b"vary", b"Accept-Encoding")]
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing large complete responses"""
+
+    def __init__(self, app, min_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = request_encoding(scope)
+        if encoding == "identity":
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        chunks = []
+
+        async def compressing_send(message):
+            nonlocal start
+            if start is None and message["type"] == "http.response.start":
+                headers = dict(message["headers"])
+                length = headers.get(b"content-length")
+                if (
+                    b"content-encoding" in headers
+                    or length is None
+                    or int(length) < self.min_size
+                    or not headers.get(b"content-type", b"").startswith(COMPRESSIBLE_TYPES)
+                ):
+                    start = False
+                    await send(message)
+                    return
+                start = message
+                return
+            if not start:
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = compress(b"".join(chunks), encoding)
+            headers = [(k, v) for k, v in start["headers"] if k != b"content-length"]
+            headers += [(b"content-encoding", encoding.encode()), (b"content-length", str(len(body)).encode())]
+            await send({**start, "headers": _vary(headers)})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, compressing_send)
@@ -1,6 +1,9 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
 
 # Database URL from environment or default to SQLite
@@ -12,24 +15,121 @@ if DATABASE_URL.startswith("postgres://"):
 
 SQLALCHEMY_DATABASE_URL = DATABASE_URL
 
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+# Connection pool settings. Size the pool per uvicorn worker: every worker
+# (and the sync engine used by scripts) opens up to
+# DB_POOL_SIZE + DB_MAX_OVERFLOW connections.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# SQLite PRAGMAs applied to every new connection. WAL lets readers run
+# alongside a writer, busy_timeout makes writers wait instead of failing
+# with "database is locked".
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
 # Different connect_args for SQLite vs PostgreSQL
 connect_args = {}
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+if IS_SQLITE:
     connect_args = {"check_same_thread": False}
 
+def get_engine_options(url: str) -> dict:
+    """Pool options for create_engine / create_async_engine"""
+    if IS_SQLITE and ":memory:" in url:
+        # In-memory databases live in a single connection
+        return {}
+    options = {}
+    if url.startswith("sqlite+aiosqlite"):
+        # aiosqlite defaults to NullPool, reopening the file on every request
+        options["poolclass"] = AsyncAdaptedQueuePool
+    return {
+        **options,
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+    }
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    cursor.close()
+
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args=connect_args
+    connect_args=connect_args,
+    **get_engine_options(SQLALCHEMY_DATABASE_URL)
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def get_async_database_url(url: str) -> str:
+    """Map the configured URL onto the async driver of the same backend"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    if backend == "postgresql":
+        # asyncpg spells libpq's sslmode as ssl
+        query = dict(url.query)
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        return url.set(drivername="postgresql+asyncpg", query=query).render_as_string(hide_password=False)
+    return url.render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = get_async_database_url(SQLALCHEMY_DATABASE_URL)
+
+# Async engine used by the API routers; the sync engine above stays for
+# one-off scripts (schema setup, migrations, seeding)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    **get_engine_options(ASYNC_DATABASE_URL)
+)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+if IS_SQLITE:
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
+# Optional read replicas, comma-separated; GET endpoints read from them
+# through app.replicas
+DATABASE_REPLICA_URLS = [
+    url.strip().replace("postgres://", "postgresql://", 1)
+    for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+]
+
+def create_replica_engine(url: str):
+    async_url = get_async_database_url(url)
+    options = get_engine_options(async_url)
+    if async_url.startswith("postgresql+asyncpg"):
+        # Refuse writes that reach a replica by mistake
+        options["connect_args"] = {"server_settings": {"default_transaction_read_only": "on"}}
+    bind = create_async_engine(async_url, **options)
+    if async_url.startswith("sqlite"):
+        event.listen(bind.sync_engine, "connect", set_sqlite_pragmas)
+    return bind
+
+replica_engines = [create_replica_engine(url) for url in DATABASE_REPLICA_URLS]
+
 Base = declarative_base()
 
 def init_db():
     """Initialize database tables"""
     from app.models import Challenge, User, UserChallenge
+    from app.migrations import upgrade_indexes
+    from app.search import create_search_index
     Base.metadata.create_all(bind=engine)
+    upgrade_indexes(engine)
+    create_search_index(engine)
 
 def get_db():
     """Dependency to get database session"""
@@ -39,3 +139,28 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Dependency to get async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def dialect_insert(db, model):
+    """INSERT construct of the session's dialect, supporting ON CONFLICT"""
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+def get_pool_stats(bind) -> dict:
+    """Current usage of an engine's connection pool"""
+    pool = bind.pool
+    stats = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if method is not None:
+            stats[name] = method()
+    if "size" in stats:
+        stats["max_overflow"] = MAX_OVERFLOW
+        stats["timeout"] = POOL_TIMEOUT
+    return stats
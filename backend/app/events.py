@@ -0,0 +1,115 @@
+"""
+Server-Sent Events broadcaster for live challenge counters and leaderboard.
+
+Writers publish changes as they commit; changes to the same object within
+EVENTS_INTERVAL are coalesced and flushed as one SSE message, encoded once
+and fanned out to every subscriber queue. Idle subscribers cost one queue
+and a suspended coroutine: nothing polls the database.
+"""
+import asyncio
+import os
+from typing import Dict, Optional, Set, Tuple
+
+import orjson
+
+from app.rank_index import rank_index
+
+EVENTS_INTERVAL = float(os.getenv("EVENTS_INTERVAL", "1.0"))
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "25"))
+# Leaderboard entries sent when any score changed during an interval
+EVENTS_LEADERBOARD_SIZE = int(os.getenv("EVENTS_LEADERBOARD_SIZE", "10"))
+# Messages a slow client may fall behind before it is disconnected
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+
+HEARTBEAT = b": keepalive\n\n"
+CLOSE = None
+
+
+class Broadcaster:
+    def __init__(self, interval: float = EVENTS_INTERVAL):
+        self.interval = interval
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._pending: Dict[Tuple[str, str], dict] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, kind: str, key: str, data: dict):
+        """Queue a change; later changes to the same (kind, key) replace it"""
+        if not self._subscribers:
+            return
+        self._pending[(kind, key)] = data
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.interval, self._flush)
+
+    def publish_challenge(self, challenge_id: str, participants_count: int, completed_count: int):
+        self.publish("challenges", challenge_id, {
+            "id": challenge_id,
+            "participants_count": participants_count,
+            "completed_count": completed_count,
+        })
+
+    def publish_user(self, user_id: str, completed_count: int):
+        self.publish("users", user_id, {"id": user_id, "completed_count": completed_count})
+
+    def _flush(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        if not pending or not self._subscribers:
+            return
+
+        update: Dict[str, list] = {}
+        for (kind, _), data in pending.items():
+            update.setdefault(kind, []).append(data)
+        if "users" in update:
+            update["leaderboard"] = rank_index.page(0, EVENTS_LEADERBOARD_SIZE)
+
+        self._send(b"event: update\ndata: " + orjson.dumps(update) + b"\n\n")
+
+    def _send(self, message):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Drop clients that stopped reading; EventSource reconnects
+                self._subscribers.discard(queue)
+
+    async def _heartbeat(self):
+        while self._subscribers:
+            await asyncio.sleep(EVENTS_HEARTBEAT)
+            self._send(HEARTBEAT)
+
+    async def subscribe(self):
+        """Yield SSE messages until the client disconnects or the server stops"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        try:
+            yield b"retry: 5000\n\n"
+            while queue in self._subscribers or not queue.empty():
+                message = await queue.get()
+                if message is CLOSE:
+                    return
+                yield message
+        finally:
+            self._subscribers.discard(queue)
+
+    async def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(CLOSE)
+            except asyncio.QueueFull:
+                pass
+        self._subscribers.clear()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+
+
+broadcaster = Broadcaster()
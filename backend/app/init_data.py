@@ -89,3 +89,5 @@ def init_test_data():
         db.close()
 
 
+if __name__ == "__main__":
+    init_test_data()
@@ -0,0 +1,275 @@
+"""
+Per-request SQL and latency metrics, exposed in Prometheus text format.
+
+MetricsMiddleware starts a RequestStats for every HTTP request. The
+SQLAlchemy cursor events below add each statement's count and duration
+to the stats of the request that issued it; the stats object is found
+through a contextvar. Routers use TimedRoute, which labels the request
+with its route template and records when the endpoint returned.
+Serialization time is measured from that point to the start of the
+response. It covers response_model validation and JSON encoding.
+
+Every request is recorded per (method, route) into histograms served by
+GET /metrics. Metrics are per process: scrape each worker, or use
+multiple targets.
+
+SLOW_QUERY_MS logs statements slower than the threshold. A statement
+run N_PLUS_ONE_THRESHOLD or more times within one request is logged as
+a likely N+1 and counted in db_n_plus_one_total.
+"""
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+import asyncio
+import functools
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from starlette.routing import Match
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Log statements slower than this many milliseconds, 0 disables
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+# Executions of the same statement in one request that count as N+1, 0 disables
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+UNMATCHED_ROUTE = "other"
+
+
+class RequestStats:
+    __slots__ = ("path", "route", "queries", "db_time", "endpoint_done", "statements")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.route: Optional[str] = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.endpoint_done: Optional[float] = None
+        self.statements: Counter = Counter()
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, labels: Tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self, label_names) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            base = ",".join(f'{name}="{value}"' for name, value in zip(label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Counter = Counter()
+
+    def inc(self, labels: Tuple, value: int = 1):
+        self._values[labels] += value
+
+    def render(self, label_names) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            base = ",".join(f'{name}="{value}"' for name, value in zip(label_names, labels))
+            lines.append(f"{self.name}{{{base}}} {value}")
+        return lines
+
+
+class Metrics:
+    ROUTE_LABELS = ("method", "route")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = CounterMetric("http_requests_total", "HTTP requests by route and status")
+        self.latency = Histogram("http_request_duration_seconds", "Total request latency", LATENCY_BUCKETS)
+        self.db_time = Histogram("http_request_db_seconds", "Time spent in SQL per request", LATENCY_BUCKETS)
+        self.serialization = Histogram(
+            "http_request_serialization_seconds", "Response validation and encoding time per request", LATENCY_BUCKETS
+        )
+        self.queries = Histogram("http_request_db_queries", "SQL statements per request", QUERY_BUCKETS)
+        self.n_plus_one = CounterMetric("db_n_plus_one_total", "Requests that repeated one statement N_PLUS_ONE_THRESHOLD+ times")
+        self.slow_queries = CounterMetric("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS")
+
+    def record(self, method: str, stats: RequestStats, status: int, total: float, serialization: Optional[float]):
+        labels = (method, stats.route or UNMATCHED_ROUTE)
+        with self._lock:
+            self.requests.inc(labels + (str(status),))
+            self.latency.observe(labels, total)
+            self.db_time.observe(labels, stats.db_time)
+            self.queries.observe(labels, stats.queries)
+            if serialization is not None:
+                self.serialization.observe(labels, serialization)
+
+    def record_n_plus_one(self, stats: RequestStats, statement: str, count: int):
+        with self._lock:
+            self.n_plus_one.inc((stats.route or UNMATCHED_ROUTE,))
+        print(f"Возможный N+1 в {stats.route or stats.path}: запрос выполнен {count} раз: {_shorten(statement)}")
+
+    def record_slow_query(self, stats: Optional[RequestStats], statement: str, elapsed: float):
+        if stats is None:
+            label = where = "background"
+        else:
+            label, where = stats.route or UNMATCHED_ROUTE, stats.route or stats.path
+        with self._lock:
+            self.slow_queries.inc((label,))
+        print(f"Медленный запрос {elapsed * 1000:.1f} мс в {where}: {_shorten(statement)}")
+
+    def render(self) -> str:
+        with self._lock:
+            lines = self.requests.render(self.ROUTE_LABELS + ("status",))
+            for histogram in (self.latency, self.db_time, self.serialization, self.queries):
+                lines += histogram.render(self.ROUTE_LABELS)
+            lines += self.n_plus_one.render(("route",))
+            lines += self.slow_queries.render(("route",))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def _shorten(statement: str, length: int = 200) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= length else statement[:length] + "..."
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        if N_PLUS_ONE_THRESHOLD:
+            stats.statements[statement] += 1
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        metrics.record_slow_query(stats, statement, elapsed)
+
+
+def instrument_engine(bind):
+    """Attach query counting and timing to a sync Engine (or async_engine.sync_engine)"""
+    if not METRICS_ENABLED:
+        return
+    event.listen(bind, "before_cursor_execute", _before_cursor_execute)
+    event.listen(bind, "after_cursor_execute", _after_cursor_execute)
+
+
+class TimedRoute(APIRoute):
+    """APIRoute that labels requests with the route template and times the endpoint"""
+
+    def get_route_handler(self):
+        call = self.dependant.call
+        if asyncio.iscoroutinefunction(call):
+            @functools.wraps(call)
+            async def timed_call(*args, **kwargs):
+                try:
+                    return await call(*args, **kwargs)
+                finally:
+                    _endpoint_done()
+        else:
+            @functools.wraps(call)
+            def timed_call(*args, **kwargs):
+                try:
+                    return call(*args, **kwargs)
+                finally:
+                    _endpoint_done()
+        self.dependant.call = timed_call
+
+        handler = super().get_route_handler()
+        route = self.path_format
+
+        async def labelled_handler(request):
+            stats = _current.get()
+            if stats is not None:
+                stats.route = route
+            return await handler(request)
+
+        return labelled_handler
+
+
+def _endpoint_done():
+    stats = _current.get()
+    if stats is not None:
+        stats.endpoint_done = time.perf_counter()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL usage of every HTTP request
+
+    Place it outermost, so responses served by the response cache are
+    recorded too; their route is resolved from `router`.
+    """
+
+    def __init__(self, app, router=None):
+        self.app = app
+        self.router = router
+
+    def _resolve_route(self, scope) -> Optional[str]:
+        for route in self.router.routes if self.router else ():
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path_format", None) or route.path
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope["path"])
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status = 500
+        response_started = None
+
+        async def send_wrapper(message):
+            nonlocal status, response_started
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_started = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            if stats.route is None:
+                stats.route = self._resolve_route(scope)
+            serialization = None
+            if stats.endpoint_done is not None and response_started is not None:
+                serialization = max(0.0, response_started - stats.endpoint_done)
+            metrics.record(scope["method"], stats, status, time.perf_counter() - started, serialization)
+            if N_PLUS_ONE_THRESHOLD and stats.statements:
+                statement, count = stats.statements.most_common(1)[0]
+                if count >= N_PLUS_ONE_THRESHOLD:
+                    metrics.record_n_plus_one(stats, statement, count)
@@ -0,0 +1,158 @@
+"""
+Schema upgrades for databases created before an index was added to the models.
+
+`Base.metadata.create_all` only creates missing tables, so indexes declared
+on an existing table never reach an old `arena.db` or Postgres database.
+This module creates them in place, and rebuilds Postgres indexes left
+invalid by an interrupted concurrent build. Run it once per deployment:
+
+    python -m app.migrations
+"""
+from sqlalchemy import bindparam, func, inspect, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+from app.database import Base, engine
+from app.models import ArchivedChallenge, ArchivedUserChallenge, Challenge, User, UserChallenge
+
+# Attempts at building a unique index while new duplicates keep arriving
+UNIQUE_INDEX_ATTEMPTS = 3
+# Ids per counter recomputation, well below SQLite's bound parameter limit
+RECOUNT_CHUNK = 1000
+
+
+def _completed(progress, challenge, column):
+    """Scalar subquery over a user's completed progress rows"""
+    return (
+        select(column)
+        .select_from(progress)
+        .join(challenge, challenge.id == progress.challenge_id)
+        .where(progress.user_id == User.id, progress.completed == True)
+        .correlate(User)
+        .scalar_subquery()
+    )
+
+
+def _recount(conn, user_ids, challenge_ids):
+    """Recompute the counters of the given users and global challenges from user_challenges"""
+    completed_challenges = (
+        _completed(UserChallenge, Challenge, func.count())
+        + _completed(ArchivedUserChallenge, ArchivedChallenge, func.count())
+    )
+    user_counters = (
+        update(User)
+        .where(User.id.in_(bindparam("ids", expanding=True)))
+        .values(
+            completed_challenges=completed_challenges,
+            total_stars=(
+                _completed(UserChallenge, Challenge, func.coalesce(func.sum(Challenge.stars), 0))
+                + _completed(ArchivedUserChallenge, ArchivedChallenge, func.coalesce(func.sum(ArchivedChallenge.stars), 0))
+            ),
+            can_publish=completed_challenges >= 5
+        )
+    )
+    participants = select(func.count()).where(UserChallenge.challenge_id == Challenge.id).correlate(Challenge)
+    challenge_counters = (
+        update(Challenge)
+        .where(Challenge.id.in_(bindparam("ids", expanding=True)), Challenge.is_global == True)
+        .values(
+            participants_count=participants.scalar_subquery(),
+            completed_count=participants.where(UserChallenge.completed == True).scalar_subquery(),
+        )
+    )
+    for statement, ids in ((user_counters, sorted(user_ids)), (challenge_counters, sorted(challenge_ids))):
+        for start in range(0, len(ids), RECOUNT_CHUNK):
+            conn.execute(statement, {"ids": ids[start:start + RECOUNT_CHUNK]})
+
+
+def _dedupe_user_challenges(conn):
+    """Drop duplicate (user_id, challenge_id) rows, keeping the oldest one
+
+    toggle_challenge always picked the first matching row, so the oldest
+    row is the one whose completion the user counters reflect. Every
+    duplicate assignment also counted a participant, so the counters of
+    the affected users and challenges are recomputed in the same
+    transaction.
+    """
+    pairs = conn.execute(text(
+        "SELECT user_id, challenge_id FROM user_challenges "
+        "GROUP BY user_id, challenge_id HAVING COUNT(*) > 1"
+    )).all()
+    if not pairs:
+        return
+    result = conn.execute(text(
+        "DELETE FROM user_challenges WHERE id NOT IN ("
+        "SELECT MIN(id) FROM user_challenges GROUP BY user_id, challenge_id)"
+    ))
+    _recount(conn, {user_id for user_id, _ in pairs}, {challenge_id for _, challenge_id in pairs})
+    print(f"Удалено дублирующихся назначений: {result.rowcount}")
+
+
+def _invalid_indexes(bind) -> set:
+    """Names of Postgres indexes left INVALID by a failed concurrent build"""
+    with bind.connect() as conn:
+        return set(conn.execute(text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE NOT i.indisvalid"
+        )).scalars())
+
+
+def _create_index_sql(index, concurrently: bool) -> str:
+    columns = ", ".join(column.name for column in index.columns)
+    return "CREATE {unique}INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({columns})".format(
+        unique="UNIQUE " if index.unique else "",
+        concurrently="CONCURRENTLY " if concurrently else "",
+        name=index.name,
+        table=index.table.name,
+        columns=columns,
+    )
+
+
+def upgrade_indexes(bind=engine):
+    """Create model indexes that are missing on existing tables"""
+    is_postgres = bind.dialect.name == "postgresql"
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    # A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind
+    # under the same name; it enforces nothing and is rebuilt below
+    invalid = _invalid_indexes(bind) if is_postgres else set()
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)} - invalid
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name in existing:
+                continue
+            dedupe = table.name == "user_challenges" and index.unique
+
+            if not is_postgres:
+                with bind.begin() as conn:
+                    if dedupe:
+                        _dedupe_user_challenges(conn)
+                    conn.execute(text(_create_index_sql(index, concurrently=False)))
+                print(f"Создан индекс {index.name}")
+                continue
+
+            # CONCURRENTLY keeps Postgres tables writable during the build,
+            # but cannot run inside a transaction block. Duplicates written
+            # between the dedupe and the build fail it: drop and retry.
+            for attempt in range(1, UNIQUE_INDEX_ATTEMPTS + 1):
+                with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+                if dedupe:
+                    with bind.begin() as conn:
+                        _dedupe_user_challenges(conn)
+                try:
+                    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                        conn.execute(text(_create_index_sql(index, concurrently=True)))
+                    break
+                except IntegrityError:
+                    if not dedupe or attempt == UNIQUE_INDEX_ATTEMPTS:
+                        raise
+                    print(f"Индекс {index.name} не построен из-за новых дубликатов, повтор")
+            print(f"Создан индекс {index.name}")
+
+
+if __name__ == "__main__":
+    from app.database import init_db
+    init_db()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Float, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -38,6 +38,11 @@ class Challenge(Base):
     # For global challenges
     participants_count = Column(Integer, default=0)
     completed_count = Column(Integer, default=0)
+    
+    # Live-feed filter and expiry scan (see app/archive.py)
+    __table_args__ = (
+        Index("ix_challenges_deadline", "deadline"),
+    )
 
 class UserChallenge(Base):
     __tablename__ = "user_challenges"
@@ -53,9 +58,65 @@ class UserChallenge(Base):
     user = relationship("User", back_populates="challenges")
     challenge = relationship("Challenge", back_populates="user_challenges")
     
-    # Unique constraint
+    # Unique constraint and lookup indexes (see app/migrations.py for existing databases)
     __table_args__ = (
+        Index("ix_user_challenges_user_challenge", "user_id", "challenge_id", unique=True),
+        Index("ix_user_challenges_user_completed", "user_id", "completed"),
+        Index("ix_user_challenges_challenge_completed", "challenge_id", "completed"),
         {"sqlite_autoincrement": True},
     )
 
 
+
+class ArchivedChallenge(Base):
+    """Expired challenge moved out of `challenges`, with its final stats"""
+    __tablename__ = "archived_challenges"
+    
+    id = Column(String, primary_key=True)
+    title = Column(String, nullable=False)
+    description = Column(String, nullable=False)
+    difficulty = Column(String, nullable=False)
+    stars = Column(Integer, nullable=False)
+    deadline = Column(DateTime, nullable=False)
+    created_by = Column(String, nullable=True)
+    is_ai = Column(Boolean, default=False)
+    is_global = Column(Boolean, default=False)
+    created_at = Column(DateTime)
+    participants_count = Column(Integer, default=0)
+    completed_count = Column(Integer, default=0)
+    archived_at = Column(DateTime, default=func.now())
+
+class ArchivedUserChallenge(Base):
+    """Progress row of an archived challenge, keeping its original id"""
+    __tablename__ = "archived_user_challenges"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String, nullable=False)
+    challenge_id = Column(String, nullable=False)
+    completed = Column(Boolean, default=False)
+    completed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime)
+    
+    __table_args__ = (
+        Index("ix_archived_user_challenges_user_completed", "user_id", "completed"),
+        Index("ix_archived_user_challenges_challenge", "challenge_id"),
+    )
+
+
+class UserDailyStats(Base):
+    """Completions and stars a user earned per day (see app/rollups.py)"""
+    __tablename__ = "user_daily_stats"
+    
+    user_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    completed = Column(Integer, nullable=False, default=0)
+    stars = Column(Integer, nullable=False, default=0)
+
+class ChallengeDailyStats(Base):
+    """Completions and stars of a challenge per day (see app/rollups.py)"""
+    __tablename__ = "challenge_daily_stats"
+    
+    challenge_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    completed = Column(Integer, nullable=False, default=0)
+    stars = Column(Integer, nullable=False, default=0)
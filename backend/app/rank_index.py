@@ -0,0 +1,157 @@
+"""
+In-process leaderboard rank index.
+
+Keeps users sorted by completed challenges so leaderboard reads never have
+to aggregate ``user_challenges``. The index is rebuilt from the database on
+startup and updated by the routers after every write that changes a score
+or a name.
+"""
+from bisect import bisect_left, bisect_right, insort
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from app.database import SessionLocal
+from app.models import User
+
+RANK_MODES = ("competition", "dense")
+
+
+class RankIndex:
+    """Sorted (score desc, user_id asc) index with tie-aware ranking"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Sorted keys (-score, user_id); ties are ordered by user_id
+        self._keys: List[Tuple[int, str]] = []
+        # Sorted distinct -score values, used for dense ranks
+        self._distinct: List[int] = []
+        self._score_counts: Dict[int, int] = {}
+        self._entries: Dict[str, Tuple[int, str]] = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, rows):
+        """Replace the index contents with (user_id, name, score) rows"""
+        entries = {user_id: (score or 0, name) for user_id, name, score in rows}
+        score_counts: Dict[int, int] = {}
+        for score, _ in entries.values():
+            score_counts[score] = score_counts.get(score, 0) + 1
+
+        with self._lock:
+            self._entries = entries
+            self._keys = sorted((-score, user_id) for user_id, (score, _) in entries.items())
+            self._score_counts = score_counts
+            self._distinct = sorted(-score for score in score_counts)
+
+    def set(self, user_id: str, name: str, score: int):
+        """Insert a user or update their name and score"""
+        score = score or 0
+        with self._lock:
+            current = self._entries.get(user_id)
+            if current is not None:
+                if current[0] == score:
+                    self._entries[user_id] = (score, name)
+                    return
+                self._remove_key(user_id, current[0])
+            self._entries[user_id] = (score, name)
+            insort(self._keys, (-score, user_id))
+            count = self._score_counts.get(score, 0)
+            if count == 0:
+                insort(self._distinct, -score)
+            self._score_counts[score] = count + 1
+
+    def remove(self, user_id: str):
+        with self._lock:
+            current = self._entries.pop(user_id, None)
+            if current is not None:
+                self._remove_key(user_id, current[0])
+
+    def _remove_key(self, user_id: str, score: int):
+        position = bisect_left(self._keys, (-score, user_id))
+        del self._keys[position]
+        count = self._score_counts[score] - 1
+        if count:
+            self._score_counts[score] = count
+        else:
+            del self._score_counts[score]
+            del self._distinct[bisect_left(self._distinct, -score)]
+
+    def _rank_of_score(self, score: int, mode: str) -> int:
+        if mode == "dense":
+            return bisect_left(self._distinct, -score) + 1
+        return bisect_left(self._keys, (-score,)) + 1
+
+    def rank(self, user_id: str, mode: str = "competition") -> Optional[dict]:
+        """Return the leaderboard entry of a single user in O(log n)"""
+        with self._lock:
+            current = self._entries.get(user_id)
+            if current is None:
+                return None
+            score, name = current
+            return self._entry(user_id, name, score, self._rank_of_score(score, mode))
+
+    def page(self, offset: int = 0, limit: Optional[int] = None, mode: str = "competition") -> List[dict]:
+        """Return entries [offset, offset + limit) with their ranks"""
+        with self._lock:
+            stop = len(self._keys) if limit is None else offset + limit
+            return self._slice(offset, stop, mode)
+
+    def page_after(self, score: int, user_id: str, limit: int, mode: str = "competition") -> List[dict]:
+        """Keyset page: the `limit` entries that sort after (score, user_id)"""
+        with self._lock:
+            start = bisect_right(self._keys, (-score, user_id))
+            return self._slice(start, start + limit, mode)
+
+    def around(self, user_id: str, radius: int, mode: str = "competition") -> Optional[List[dict]]:
+        """Return up to `radius` entries on each side of a user, the user included"""
+        with self._lock:
+            current = self._entries.get(user_id)
+            if current is None:
+                return None
+            position = bisect_left(self._keys, (-current[0], user_id))
+            return self._slice(max(0, position - radius), position + radius + 1, mode)
+
+    def _slice(self, start: int, stop: int, mode: str) -> List[dict]:
+        keys = self._keys[start:stop]
+        if not keys:
+            return []
+
+        result = []
+        previous_score = None
+        rank = 0
+        for position, (negative_score, user_id) in enumerate(keys, start=start):
+            score = -negative_score
+            if score != previous_score:
+                if previous_score is None:
+                    rank = self._rank_of_score(score, mode)
+                elif mode == "dense":
+                    rank += 1
+                else:
+                    rank = position + 1
+                previous_score = score
+            result.append(self._entry(user_id, self._entries[user_id][1], score, rank))
+        return result
+
+    @staticmethod
+    def _entry(user_id: str, name: str, score: int, rank: int) -> dict:
+        return {
+            "id": user_id,
+            "name": name,
+            "completed_count": score,
+            "rank": rank,
+            "avatar": None
+        }
+
+
+rank_index = RankIndex()
+
+
+def load_rank_index():
+    """Rebuild the global rank index from the users table"""
+    db = SessionLocal()
+    try:
+        rows = db.query(User.id, User.name, User.completed_challenges).all()
+        rank_index.load(rows)
+    finally:
+        db.close()
@@ -0,0 +1,232 @@
+"""
+Reconciliation of denormalized counters against user_challenges.
+
+Recomputes users.completed_challenges / total_stars / can_publish (live
+and archived progress) and participants_count / completed_count of live
+global challenges with aggregate SQL, a chunk of CHUNK_SIZE rows at a
+time. Each chunk is one short transaction, so a large live database is
+never locked for long.
+
+Drifted rows are corrected by the difference measured in the same
+snapshot (`SET x = x + delta`) rather than overwritten, so a toggle that
+commits between the check and the fix is not lost.
+
+    python -m app.reconcile          # report drift
+    python -m app.reconcile --fix    # report and correct it
+"""
+import argparse
+import asyncio
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, select, union_all, update
+
+from app.bus import invalidation_bus, publish_changes
+from app.database import AsyncSessionLocal, async_engine
+from app.models import ArchivedChallenge, ArchivedUserChallenge, Challenge, User, UserChallenge
+
+CHUNK_SIZE = 1000
+# Drifted rows listed in a report
+SAMPLE_SIZE = 20
+
+
+async def _next_ids(db, column, last, chunk_size: int, *where) -> List[str]:
+    query = select(column).where(*where).order_by(column).limit(chunk_size)
+    if last is not None:
+        query = query.where(column > last)
+    return (await db.execute(query)).scalars().all()
+
+
+async def reconcile_users(db, user_ids, fix: bool, fixed: Optional[list] = None) -> List[dict]:
+    """Compare and optionally correct the counters of the given users
+
+    Corrected (id, name, completed_challenges) rows are appended to fixed.
+    """
+    completed = union_all(
+        select(UserChallenge.user_id, Challenge.stars)
+        .join(Challenge, Challenge.id == UserChallenge.challenge_id)
+        .where(UserChallenge.user_id.in_(user_ids), UserChallenge.completed == True),
+        select(ArchivedUserChallenge.user_id, ArchivedChallenge.stars)
+        .join(ArchivedChallenge, ArchivedChallenge.id == ArchivedUserChallenge.challenge_id)
+        .where(ArchivedUserChallenge.user_id.in_(user_ids), ArchivedUserChallenge.completed == True),
+    ).subquery()
+    totals = (
+        select(
+            completed.c.user_id,
+            func.count().label("completed_challenges"),
+            func.sum(completed.c.stars).label("total_stars"),
+        )
+        .group_by(completed.c.user_id)
+        .subquery()
+    )
+    rows = (await db.execute(
+        select(
+            User.id,
+            func.coalesce(User.completed_challenges, 0).label("completed_challenges"),
+            func.coalesce(User.total_stars, 0).label("total_stars"),
+            func.coalesce(User.can_publish, False).label("can_publish"),
+            func.coalesce(totals.c.completed_challenges, 0).label("expected_completed"),
+            func.coalesce(totals.c.total_stars, 0).label("expected_stars"),
+        )
+        .outerjoin(totals, totals.c.user_id == User.id)
+        .where(User.id.in_(user_ids))
+    )).all()
+
+    drift = [
+        row for row in rows
+        if row.completed_challenges != row.expected_completed
+        or row.total_stars != row.expected_stars
+        or bool(row.can_publish) != (row.expected_completed >= 5)
+    ]
+    if fix:
+        for row in drift:
+            completed_challenges = (
+                func.coalesce(User.completed_challenges, 0) + (row.expected_completed - row.completed_challenges)
+            )
+            user = (await db.execute(
+                update(User)
+                .where(User.id == row.id)
+                .values(
+                    completed_challenges=completed_challenges,
+                    total_stars=func.coalesce(User.total_stars, 0) + (row.expected_stars - row.total_stars),
+                    can_publish=completed_challenges >= 5
+                )
+                .returning(User.id, User.name, User.completed_challenges)
+                .execution_options(synchronize_session=False)
+            )).first()
+            if user and fixed is not None:
+                fixed.append(user)
+
+    return [
+        {
+            "id": row.id,
+            "completed_challenges": [row.completed_challenges, row.expected_completed],
+            "total_stars": [row.total_stars, row.expected_stars],
+        }
+        for row in drift
+    ]
+
+
+async def reconcile_challenges(db, challenge_ids, fix: bool, fixed: Optional[list] = None) -> List[dict]:
+    """Compare and optionally correct the counters of the given global challenges
+
+    Corrected (id, participants_count, completed_count) rows are appended to fixed.
+    """
+    totals = (
+        select(
+            UserChallenge.challenge_id,
+            func.count().label("participants_count"),
+            func.count().filter(UserChallenge.completed == True).label("completed_count"),
+        )
+        .where(UserChallenge.challenge_id.in_(challenge_ids))
+        .group_by(UserChallenge.challenge_id)
+        .subquery()
+    )
+    rows = (await db.execute(
+        select(
+            Challenge.id,
+            func.coalesce(Challenge.participants_count, 0).label("participants_count"),
+            func.coalesce(Challenge.completed_count, 0).label("completed_count"),
+            func.coalesce(totals.c.participants_count, 0).label("expected_participants"),
+            func.coalesce(totals.c.completed_count, 0).label("expected_completed"),
+        )
+        .outerjoin(totals, totals.c.challenge_id == Challenge.id)
+        .where(Challenge.id.in_(challenge_ids))
+    )).all()
+
+    drift = [
+        row for row in rows
+        if row.participants_count != row.expected_participants
+        or row.completed_count != row.expected_completed
+    ]
+    if fix:
+        for row in drift:
+            challenge = (await db.execute(
+                update(Challenge)
+                .where(Challenge.id == row.id)
+                .values(
+                    participants_count=func.coalesce(Challenge.participants_count, 0)
+                    + (row.expected_participants - row.participants_count),
+                    completed_count=func.coalesce(Challenge.completed_count, 0)
+                    + (row.expected_completed - row.completed_count),
+                )
+                .returning(Challenge.id, Challenge.participants_count, Challenge.completed_count)
+                .execution_options(synchronize_session=False)
+            )).first()
+            if challenge and fixed is not None:
+                fixed.append(challenge)
+
+    return [
+        {
+            "id": row.id,
+            "participants_count": [row.participants_count, row.expected_participants],
+            "completed_count": [row.completed_count, row.expected_completed],
+        }
+        for row in drift
+    ]
+
+
+async def reconcile(fix: bool = False, chunk_size: int = CHUNK_SIZE) -> Dict[str, object]:
+    """Check every user and live global challenge, one chunk per transaction
+
+    Drift is reported as [stored, expected] pairs for up to SAMPLE_SIZE rows.
+    """
+    report = {
+        "users_checked": 0,
+        "users_drifted": 0,
+        "challenges_checked": 0,
+        "challenges_drifted": 0,
+        "fixed": fix,
+        "samples": [],
+    }
+
+    async with AsyncSessionLocal() as db:
+        jobs = (
+            ("users", User.id, (), reconcile_users),
+            ("challenges", Challenge.id, (Challenge.is_global == True,), reconcile_challenges),
+        )
+        for name, key, where, check in jobs:
+            last = None
+            while True:
+                ids = await _next_ids(db, key, last, chunk_size, *where)
+                if not ids:
+                    break
+                fixed = []
+                drift = await check(db, ids, fix, fixed)
+                await db.commit()
+                if fixed:
+                    publish_changes(**{name: [tuple(row) for row in fixed]})
+
+                report[f"{name}_checked"] += len(ids)
+                report[f"{name}_drifted"] += len(drift)
+                room = SAMPLE_SIZE - len(report["samples"])
+                report["samples"].extend({"table": name, **row} for row in drift[:room])
+                last = ids[-1]
+                if len(ids) < chunk_size:
+                    break
+
+    if fix and (report["users_drifted"] or report["challenges_drifted"]):
+        publish_changes(clear=True)
+    return report
+
+
+async def _run(fix: bool, chunk_size: int):
+    # With --fix, running workers pick up the corrected counters
+    await invalidation_bus.start()
+    report = await reconcile(fix, chunk_size)
+    await invalidation_bus.close()
+    await async_engine.dispose()
+    for sample in report.pop("samples"):
+        print(sample)
+    print(report)
+
+
+def main(argv: Iterable[str] = None):
+    parser = argparse.ArgumentParser(description="Check denormalized counters against user_challenges")
+    parser.add_argument("--fix", action="store_true", help="correct drifted counters")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    asyncio.run(_run(args.fix, args.chunk_size))
+
+
+if __name__ == "__main__":
+    main()
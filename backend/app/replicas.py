@@ -0,0 +1,178 @@
+"""
+Read-replica routing for GET endpoints.
+
+With DATABASE_REPLICA_URLS set, get_read_db hands out sessions on the
+replicas in turn. Every REPLICA_CHECK_INTERVAL seconds each worker
+measures how far every replica is behind. A replica that lags more than
+REPLICA_MAX_LAG_SECONDS, or fails the check, gets no reads until it
+catches up. With no replica available, reads go to the primary.
+
+Read-your-writes: after a toggle or assign, that user's reads use the
+primary for REPLICA_MAX_LAG_SECONDS + REPLICA_CHECK_INTERVAL, long
+enough for any replica still in rotation to have the write. The
+invalidation bus carries the mark to the other workers.
+
+Lag is measured on Postgres streaming replicas. Any other database only
+gets a health check and counts as current.
+"""
+import asyncio
+from itertools import count
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import Request
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.cache import READ_LAG_SCOPE_KEY
+from app.database import AsyncSessionLocal, replica_engines
+
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "2"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "1"))
+
+# Seconds since the last replayed transaction, 0 when nothing is waiting
+# to be replayed or the server is not a standby
+POSTGRES_LAG = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class Replica:
+    def __init__(self, bind):
+        self.bind = bind
+        self.name = bind.url.render_as_string(hide_password=True)
+        self.sessionmaker = async_sessionmaker(bind, autoflush=False, expire_on_commit=False)
+        # None until the first successful check
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = None
+        self.reads = 0
+
+    @property
+    def available(self) -> bool:
+        return self.error is None and self.lag is not None and self.lag <= REPLICA_MAX_LAG
+
+    async def check(self):
+        try:
+            async with self.bind.connect() as conn:
+                if self.bind.dialect.name == "postgresql":
+                    lag = (await conn.execute(POSTGRES_LAG)).scalar()
+                else:
+                    await conn.execute(text("SELECT 1"))
+                    lag = 0
+        except Exception as e:
+            if self.error is None:
+                print(f"Реплика {self.name} недоступна: {e}")
+            self.error = str(e)
+            return
+        if self.error is not None:
+            print(f"Реплика {self.name} снова доступна")
+        self.error = None
+        self.lag = None if lag is None else float(lag)
+
+
+class ReplicaRouter:
+    def __init__(self, binds=(), interval: float = REPLICA_CHECK_INTERVAL):
+        self.replicas: List[Replica] = [Replica(bind) for bind in binds]
+        self.interval = interval
+        # How long a user's reads stay on the primary after a write
+        self.sticky_seconds = REPLICA_MAX_LAG + interval
+        self._sticky: Dict[str, float] = {}
+        self._turn = count()
+        self.primary_reads = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def stick(self, user_ids: Iterable[str]):
+        """Send these users' reads to the primary for sticky_seconds"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if len(self._sticky) > 10000:
+            self._sticky = {user_id: until for user_id, until in self._sticky.items() if until > now}
+        until = now + self.sticky_seconds
+        for user_id in user_ids:
+            self._sticky[user_id] = until
+
+    def is_sticky(self, user_id: Optional[str]) -> bool:
+        return user_id is not None and self._sticky.get(user_id, 0) > time.monotonic()
+
+    def choose(self, user_id: Optional[str] = None) -> Optional[Replica]:
+        """Replica to read from, or None for the primary"""
+        if not self.enabled or self.is_sticky(user_id):
+            return None
+        candidates = [replica for replica in self.replicas if replica.available]
+        if not candidates:
+            return None
+        return candidates[next(self._turn) % len(candidates)]
+
+    async def check(self):
+        await asyncio.gather(*(replica.check() for replica in self.replicas))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        # Lags are known before the first read
+        await self.check()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            await replica.bind.dispose()
+
+    def stats(self) -> dict:
+        return {
+            "primary_reads": self.primary_reads,
+            "sticky_users": sum(1 for until in self._sticky.values() if until > time.monotonic()),
+            "max_lag": REPLICA_MAX_LAG,
+            "replicas": [
+                {
+                    "url": replica.name,
+                    "available": replica.available,
+                    "lag": replica.lag,
+                    "error": replica.error,
+                    "reads": replica.reads,
+                }
+                for replica in self.replicas
+            ],
+        }
+
+
+replica_router = ReplicaRouter(replica_engines)
+
+
+async def get_read_db(request: Request):
+    """Dependency for read-only endpoints: a session on a replica or the primary
+
+    The user is taken from a user_id path or query parameter, for
+    read-your-writes stickiness.
+    """
+    user_id = request.path_params.get("user_id") or request.query_params.get("user_id")
+    replica = replica_router.choose(user_id)
+    if replica is None:
+        if replica_router.enabled:
+            replica_router.primary_reads += 1
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    replica.reads += 1
+    # Do not let the response cache keep this answer past a write it may predate
+    request.scope[READ_LAG_SCOPE_KEY] = replica_router.sticky_seconds
+    async with replica.sessionmaker() as db:
+        yield db
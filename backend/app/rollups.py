@@ -0,0 +1,190 @@
+"""
+Daily rollups of completions: user_daily_stats and challenge_daily_stats.
+
+A completion counts on the day of its completed_at. Toggles, the
+write-behind flush and challenge deletion adjust the rollups in the same
+transaction as user_challenges: +1 on the completion day, or -1 on the
+day of the completion being undone. A history read is then a primary key
+range scan over at most one row per day, however long the user's history.
+
+The backfill job recomputes the rollups from user_challenges and
+archived_user_challenges, a chunk of CHUNK_SIZE users or challenges per
+transaction. Like app.reconcile, it corrects rows by the difference
+measured in one statement, so toggles committed while it runs are not
+lost. Run it once after deploying, and after importing progress with
+app.transfer:
+
+    python -m app.rollups
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Date, delete, func, literal, or_, select, union_all
+
+from app.bus import invalidation_bus, publish_changes
+from app.database import AsyncSessionLocal, async_engine, dialect_insert
+from app.models import (
+    ArchivedChallenge, ArchivedUserChallenge, Challenge, ChallengeDailyStats, User, UserChallenge, UserDailyStats,
+)
+
+CHUNK_SIZE = 1000
+# Rows per INSERT ... ON CONFLICT, well below SQLite's bound parameter limit
+UPSERT_CHUNK = 1000
+
+# user_id, challenge_id, completed_at, +1 or -1, stars of the challenge
+Completion = Tuple[str, str, Optional[datetime], int, int]
+
+
+async def _add(db, model, key: str, deltas: Dict[Tuple[str, date], List[int]]):
+    """Add [completed, stars] deltas to (key, day) rows, creating missing ones"""
+    rows = [
+        {key: value, "day": day, "completed": completed, "stars": stars}
+        for (value, day), (completed, stars) in deltas.items() if completed or stars
+    ]
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        statement = dialect_insert(db, model).values(rows[start:start + UPSERT_CHUNK])
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[key, "day"],
+            set_={
+                "completed": model.completed + statement.excluded.completed,
+                "stars": model.stars + statement.excluded.stars,
+            }
+        ))
+
+
+async def record_completions(db, completions: Iterable[Completion], per_challenge: bool = True):
+    """Add completions and undone completions to the rollups; the caller commits
+
+    Progress completed before completed_at was recorded has no day and is
+    skipped.
+    """
+    users: Dict[Tuple[str, date], List[int]] = defaultdict(lambda: [0, 0])
+    challenges: Dict[Tuple[str, date], List[int]] = defaultdict(lambda: [0, 0])
+    for user_id, challenge_id, completed_at, delta, stars in completions:
+        if completed_at is None:
+            continue
+        day = completed_at.date()
+        for totals in (users[(user_id, day)], challenges[(challenge_id, day)]):
+            totals[0] += delta
+            totals[1] += delta * (stars or 0)
+    await _add(db, UserDailyStats, "user_id", users)
+    if per_challenge:
+        await _add(db, ChallengeDailyStats, "challenge_id", challenges)
+
+
+async def user_history(db, user_id: str, start: date, end: date) -> dict:
+    """Completions and stars of a user for every day in [start, end]"""
+    rows = (await db.execute(
+        select(UserDailyStats.day, UserDailyStats.completed, UserDailyStats.stars)
+        .where(UserDailyStats.user_id == user_id, UserDailyStats.day >= start, UserDailyStats.day <= end)
+    )).all()
+    by_day = {row.day: row for row in rows}
+    days = []
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        row = by_day.get(day)
+        days.append({"day": day, "completed": row.completed if row else 0, "stars": row.stars if row else 0})
+    return {
+        "user_id": user_id,
+        "start": start,
+        "end": end,
+        "completed": sum(day["completed"] for day in days),
+        "stars": sum(day["stars"] for day in days),
+        "days": days,
+    }
+
+
+def _completions(key: str, ids) -> list:
+    """SELECTs of (key, completed_at, stars) for completed live and archived progress"""
+    sources = (
+        (UserChallenge, Challenge),
+        (ArchivedUserChallenge, ArchivedChallenge),
+    )
+    return [
+        select(getattr(progress, key).label("key"), progress.completed_at, challenge.stars.label("stars"))
+        .join(challenge, challenge.id == progress.challenge_id)
+        .where(getattr(progress, key).in_(ids), progress.completed == True, progress.completed_at.isnot(None))
+        for progress, challenge in sources
+    ]
+
+
+async def backfill_chunk(db, model, key: str, ids) -> int:
+    """Bring the rollup rows of the given users or challenges in line with their progress
+
+    Returns the number of (key, day) rows corrected; the caller commits.
+    """
+    completions = union_all(*_completions(key, ids)).subquery()
+    column = getattr(model, key)
+    # Expected rows minus stored rows, in one statement so both come from one snapshot
+    difference = union_all(
+        select(
+            completions.c.key,
+            func.date(completions.c.completed_at, type_=Date).label("day"),
+            literal(1).label("completed"),
+            completions.c.stars,
+        ),
+        select(column.label("key"), model.day, -model.completed, -model.stars).where(column.in_(ids)),
+    ).subquery()
+    completed = func.sum(difference.c.completed)
+    stars = func.sum(difference.c.stars)
+    rows = (await db.execute(
+        select(difference.c.key, difference.c.day, completed, stars)
+        .group_by(difference.c.key, difference.c.day)
+        .having(or_(completed != 0, stars != 0))
+    )).all()
+
+    await _add(db, model, key, {(row[0], row[1]): [row[2], row[3]] for row in rows})
+    await db.execute(delete(model).where(column.in_(ids), model.completed == 0, model.stars == 0))
+    return len(rows)
+
+
+async def backfill(chunk_size: int = CHUNK_SIZE) -> Dict[str, int]:
+    """Recompute every user and challenge rollup, one chunk per transaction"""
+    report = {"users_checked": 0, "user_days_fixed": 0, "challenges_checked": 0, "challenge_days_fixed": 0}
+    jobs = (
+        ("users", "user_days_fixed", User.id, UserDailyStats, "user_id"),
+        ("challenges", "challenge_days_fixed", Challenge.id, ChallengeDailyStats, "challenge_id"),
+        ("challenges", "challenge_days_fixed", ArchivedChallenge.id, ChallengeDailyStats, "challenge_id"),
+    )
+    async with AsyncSessionLocal() as db:
+        for name, fixed, id_column, model, key in jobs:
+            last = None
+            while True:
+                query = select(id_column).order_by(id_column).limit(chunk_size)
+                if last is not None:
+                    query = query.where(id_column > last)
+                ids = (await db.execute(query)).scalars().all()
+                if not ids:
+                    break
+                report[fixed] += await backfill_chunk(db, model, key, ids)
+                await db.commit()
+                report[f"{name}_checked"] += len(ids)
+                last = ids[-1]
+                if len(ids) < chunk_size:
+                    break
+    if report["user_days_fixed"] or report["challenge_days_fixed"]:
+        # Cached histories may predate the fixes
+        publish_changes(clear=True)
+    return report
+
+
+async def _run(chunk_size: int):
+    await invalidation_bus.start()
+    report = await backfill(chunk_size)
+    await invalidation_bus.close()
+    await async_engine.dispose()
+    print(report)
+
+
+def main(argv: Iterable[str] = None):
+    parser = argparse.ArgumentParser(description="Backfill the daily completion rollups")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    asyncio.run(_run(args.chunk_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,169 +1,88 @@
 from fastapi import APIRouter, HTTPException
-from openai import OpenAI
-import os
-from typing import Optional
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import insert
+from datetime import datetime, timedelta
+import json
+import uuid
 
-from app.schemas import AIGenerateRequest, AIGenerateResponse
+from app.ai_generator import challenge_generator
+from app.bus import publish_changes
+from app.database import AsyncSessionLocal
+from app.metrics import TimedRoute
+from app.models import Challenge
+from app.schemas import AIBatchRequest, AIGenerateRequest, AIGenerateResponse
 
-router = APIRouter()
-
-# Initialize OpenAI client (will use environment variable OPENAI_API_KEY)
-client = None
-try:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if api_key:
-        client = OpenAI(api_key=api_key)
-except:
-    pass
-
-def get_stars_by_difficulty(difficulty: str) -> int:
-    """Map difficulty to stars"""
-    mapping = {
-        "easy": 3,
-        "medium": 5,
-        "hard": 8,
-        "extreme": 10
-    }
-    return mapping.get(difficulty, 5)
+router = APIRouter(route_class=TimedRoute)
 
 @router.post("/generate-challenge", response_model=AIGenerateResponse)
 async def generate_challenge(request: AIGenerateRequest):
-    """Generate a challenge using AI"""
+    """Generate a challenge using AI
     
-    # Fallback challenges if OpenAI is not configured
-    fallback_challenges = [
-        {
-            "title": "Read a book for 30 minutes daily",
-            "description": "Dedicate 30 minutes each day to reading. Choose any book you like and track your progress.",
-            "difficulty": "easy",
-            "stars": 3,
-        },
-        {
-            "title": "Learn a new skill online",
-            "description": "Take an online course or watch tutorials to learn something new. Complete at least one module per day.",
-            "difficulty": "medium",
-            "stars": 5,
-        },
-        {
-            "title": "30-day fitness challenge",
-            "description": "Exercise for at least 45 minutes daily. Mix cardio, strength training, and flexibility exercises.",
-            "difficulty": "hard",
-            "stars": 8,
-        },
-        {
-            "title": "Digital detox weekend",
-            "description": "Spend an entire weekend without using social media or unnecessary digital devices.",
-            "difficulty": "medium",
-            "stars": 5,
-        },
-        {
-            "title": "Cook a new recipe every day",
-            "description": "Challenge yourself to cook a different recipe each day. Try cuisines you've never attempted before.",
-            "difficulty": "hard",
-            "stars": 7,
-        },
-        {
-            "title": "Meditation and mindfulness",
-            "description": "Practice meditation for 15 minutes every morning. Focus on breathing and mindfulness techniques.",
-            "difficulty": "easy",
-            "stars": 3,
-        },
-        {
-            "title": "No sugar challenge",
-            "description": "Avoid all added sugars and sugary foods for 7 days. Read labels carefully and choose natural alternatives.",
-            "difficulty": "medium",
-            "stars": 5,
-        },
-        {
-            "title": "Morning routine mastery",
-            "description": "Wake up at the same time every day and complete a 1-hour morning routine including exercise, planning, and self-care.",
-            "difficulty": "hard",
-            "stars": 8,
-        },
-    ]
+    Served from a background-refilled pool of pre-generated challenges;
+    falls back to predefined challenges if OpenAI is not configured or fails.
+    """
+    challenge = await challenge_generator.get(request.difficulty, request.category)
+    return AIGenerateResponse(**challenge)
+
+@router.post("/generate-batch")
+async def generate_batch(request: AIBatchRequest):
+    """Generate many challenges concurrently, streamed back as NDJSON
     
-    # If OpenAI is not configured, use fallback
-    if not client:
-        import random
-        challenge = random.choice(fallback_challenges)
-        if request.difficulty:
-            # Filter by difficulty if specified
-            filtered = [c for c in fallback_challenges if c["difficulty"] == request.difficulty]
-            if filtered:
-                challenge = random.choice(filtered)
-        
-        return AIGenerateResponse(
-            title=challenge["title"],
-            description=challenge["description"],
-            difficulty=challenge["difficulty"],
-            stars=challenge["stars"]
-        )
+    Each line is {"index", "challenge"} or {"index", "error"} in completion
+    order. With persist=true the generated challenges are saved with
+    is_ai=True in one bulk insert after the last one, and a final
+    {"persisted": n, "ids": {index: id}} line is sent once it has
+    committed, or {"persisted": 0, "error"} if it failed. Persisting needs
+    OpenAI: predefined fallback challenges are never saved as AI content.
+    """
+    if request.persist and not challenge_generator.client:
+        raise HTTPException(status_code=503, detail="persist requires OpenAI: OPENAI_API_KEY is not set")
+    specs = [(spec.difficulty, spec.category) for spec in request.specs]
     
-    # Use OpenAI to generate challenge
-    try:
-        difficulty = request.difficulty or "medium"
-        category = request.category or "general"
-        
-        prompt = f"""Generate a creative and engaging personal challenge. 
-        
-Requirements:
-- Difficulty level: {difficulty}
-- Category: {category}
-- The challenge should be specific, measurable, and achievable
-- Make it inspiring and motivating
-- Return ONLY a JSON object with these exact fields: title, description, difficulty, stars
-
-Example format:
-{{
-    "title": "30-Day Fitness Challenge",
-    "description": "Exercise for at least 45 minutes daily. Mix cardio, strength training, and flexibility exercises.",
-    "difficulty": "hard",
-    "stars": 8
-}}
-
-Generate the challenge now:"""
-
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a creative challenge generator. Always respond with valid JSON only."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.8,
-            max_tokens=200
-        )
+    async def stream():
+        rows = {}
+        deadline = datetime.now() + timedelta(days=request.deadline_days)
         
-        import json
-        content = response.choices[0].message.content.strip()
+        async for index, challenge, error in challenge_generator.generate_many(specs):
+            if error is not None:
+                yield json.dumps({"index": index, "error": error}) + "\n"
+                continue
+            
+            try:
+                line = {"index": index, "challenge": AIGenerateResponse(**challenge).model_dump()}
+            except (TypeError, ValidationError) as e:
+                # One malformed item must not cut off the stream or the persist
+                fields = sorted({str(err["loc"][0]) for err in e.errors()}) if isinstance(e, ValidationError) else []
+                yield json.dumps({"index": index, "error": f"invalid challenge: {', '.join(fields) or e}"}) + "\n"
+                continue
+            if request.persist:
+                rows[index] = {
+                    "id": str(uuid.uuid4()),
+                    **line["challenge"],
+                    "deadline": deadline,
+                    "created_by": request.created_by,
+                    "is_ai": True,
+                    "is_global": request.is_global,
+                    "participants_count": 0,
+                    "completed_count": 0,
+                }
+            yield json.dumps(line) + "\n"
         
-        # Try to extract JSON from response
-        if content.startswith("```json"):
-            content = content.replace("```json", "").replace("```", "").strip()
-        elif content.startswith("```"):
-            content = content.replace("```", "").strip()
-        
-        challenge_data = json.loads(content)
-        
-        # Ensure stars match difficulty
-        challenge_data["stars"] = get_stars_by_difficulty(challenge_data.get("difficulty", difficulty))
-        challenge_data["difficulty"] = challenge_data.get("difficulty", difficulty)
-        
-        return AIGenerateResponse(**challenge_data)
-        
-    except Exception as e:
-        # Fallback to predefined challenges on error
-        import random
-        challenge = random.choice(fallback_challenges)
-        if request.difficulty:
-            filtered = [c for c in fallback_challenges if c["difficulty"] == request.difficulty]
-            if filtered:
-                challenge = random.choice(filtered)
-        
-        return AIGenerateResponse(
-            title=challenge["title"],
-            description=challenge["description"],
-            difficulty=challenge["difficulty"],
-            stars=challenge["stars"]
-        )
-
-
+        if request.persist:
+            # The session is opened here, not via Depends, because it must
+            # outlive the handler while the response streams
+            try:
+                async with AsyncSessionLocal() as db:
+                    if rows:
+                        await db.execute(insert(Challenge), list(rows.values()))
+                        await db.commit()
+                        publish_changes(paths=["/api/challenges"])
+            except Exception as e:
+                # Headers are already sent: report the failure in the stream
+                yield json.dumps({"persisted": 0, "error": str(e) or type(e).__name__}) + "\n"
+                return
+            ids = {index: row["id"] for index, row in rows.items()}
+            yield json.dumps({"persisted": len(rows), "ids": ids}) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
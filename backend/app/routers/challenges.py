@@ -1,107 +1,164 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from sqlalchemy import and_, or_, not_, case, delete, false, func, literal, select, update
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
 from datetime import datetime
 
-from app.database import get_db
-from app.models import Challenge, UserChallenge, User
-from app.schemas import ChallengeCreate, ChallengeResponse, UserChallengeResponse, UserChallengeToggle
+from app.archive import live_filter
+from app.bus import publish_changes
+from app.database import dialect_insert, get_async_db
+from app.metrics import TimedRoute
+from app.models import ArchivedChallenge, Challenge, ChallengeDailyStats, UserChallenge, User
+from app.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from app.replicas import get_read_db
+from app.rollups import record_completions
+from app.search import search_query
+from app.schemas import BulkAssignRequest, BulkAssignResponse, ChallengeCreate, ChallengeResponse, UserChallengeResponse, UserChallengeToggle
+from app.toggles import clamped_increment, publish_toggles, toggle_queue
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
-@router.get("/", response_model=List[ChallengeResponse])
+# Only the columns the feed returns; rows map 1:1 onto ChallengeResponse
+FEED_COLUMNS = (
+    Challenge.id,
+    Challenge.title,
+    Challenge.description,
+    Challenge.difficulty,
+    Challenge.stars,
+    Challenge.deadline,
+    Challenge.created_by,
+    Challenge.is_ai,
+    Challenge.is_global,
+    Challenge.participants_count,
+    Challenge.completed_count,
+    Challenge.created_at,
+)
+
+@router.get("/", response_model=List[ChallengeResponse], response_class=ORJSONResponse)
 async def get_challenges(
     user_id: Optional[str] = None,
     filter_type: Optional[str] = None,  # all, active, completed
     global_only: Optional[bool] = False,
-    db: Session = Depends(get_db)
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    include_expired: bool = False,
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Get all challenges or user-specific challenges"""
-    query = db.query(Challenge)
+    """Get all challenges or user-specific challenges
     
-    if global_only:
-        query = query.filter(Challenge.is_global == True)
+    Runs as a single query: the user's progress is outer-joined onto the
+    challenges and filter_type is applied in SQL. Results are ordered by
+    creation time; pass the X-Next-Cursor header as `cursor` for the next page.
+    Challenges past their deadline are left out unless include_expired is set.
     
+    Rows come straight from the database, so they are encoded with orjson
+    without a second validation pass against ChallengeResponse.
+    """
     if user_id:
-        # Get user's challenges
-        user_challenges = db.query(UserChallenge).filter(
+        await toggle_queue.flush_user(user_id)
+        completed = func.coalesce(UserChallenge.completed, False)
+        join_on = and_(
+            UserChallenge.challenge_id == Challenge.id,
             UserChallenge.user_id == user_id
-        ).all()
+        )
+        query = select(*FEED_COLUMNS, completed.label("completed"))
         
         # For global challenges, show all even if not assigned
         if global_only:
-            challenges = query.all()
-            challenge_ids = [uc.challenge_id for uc in user_challenges]
-            user_challenge_map = {uc.challenge_id: uc for uc in user_challenges}
+            query = query.outerjoin(UserChallenge, join_on)
         else:
-            challenge_ids = [uc.challenge_id for uc in user_challenges]
-            query = query.filter(Challenge.id.in_(challenge_ids))
-            challenges = query.all()
-            user_challenge_map = {uc.challenge_id: uc for uc in user_challenges}
-        
-        result = []
-        
-        for challenge in challenges:
-            uc = user_challenge_map.get(challenge.id)
-            completed = uc.completed if uc else False
-            
-            if filter_type == "active" and completed:
-                continue
-            if filter_type == "completed" and not completed:
-                continue
-            
-            challenge_dict = {
-                "id": challenge.id,
-                "title": challenge.title,
-                "description": challenge.description,
-                "difficulty": challenge.difficulty,
-                "stars": challenge.stars,
-                "deadline": challenge.deadline.isoformat() if hasattr(challenge.deadline, 'isoformat') else challenge.deadline,
-                "created_by": challenge.created_by,
-                "is_ai": challenge.is_ai,
-                "is_global": challenge.is_global,
-                "participants_count": challenge.participants_count,
-                "completed_count": challenge.completed_count,
-                "created_at": challenge.created_at.isoformat() if challenge.created_at and hasattr(challenge.created_at, 'isoformat') else challenge.created_at,
-                "completed": completed,  # Add completion status
-            }
-            result.append(challenge_dict)
+            query = query.join(UserChallenge, join_on)
         
-        return result
+        if filter_type == "active":
+            query = query.where(completed == False)
+        elif filter_type == "completed":
+            query = query.where(completed == True)
     else:
         # Get all challenges (without user context)
-        challenges = query.all()
-        result = []
-        for challenge in challenges:
-            challenge_dict = {
-                "id": challenge.id,
-                "title": challenge.title,
-                "description": challenge.description,
-                "difficulty": challenge.difficulty,
-                "stars": challenge.stars,
-                "deadline": challenge.deadline.isoformat() if hasattr(challenge.deadline, 'isoformat') else challenge.deadline,
-                "created_by": challenge.created_by,
-                "is_ai": challenge.is_ai,
-                "is_global": challenge.is_global,
-                "participants_count": challenge.participants_count,
-                "completed_count": challenge.completed_count,
-                "created_at": challenge.created_at.isoformat() if challenge.created_at and hasattr(challenge.created_at, 'isoformat') else challenge.created_at,
-                "completed": False,
-            }
-            result.append(challenge_dict)
-        return result
+        query = select(*FEED_COLUMNS, false().label("completed"))
+    
+    if global_only:
+        query = query.where(Challenge.is_global == True)
+    if not include_expired:
+        query = query.where(live_filter())
+    
+    if cursor:
+        # Compare against the stored row so the timestamp never round-trips
+        # through the client (SQLite keeps it as text)
+        last_id, = decode_cursor(cursor, 1)
+        last = aliased(Challenge)
+        last_created_at = select(last.created_at).where(last.id == last_id).scalar_subquery()
+        query = query.where(or_(
+            Challenge.created_at > last_created_at,
+            and_(Challenge.created_at == last_created_at, Challenge.id > last_id)
+        ))
+    
+    query = query.order_by(Challenge.created_at, Challenge.id)
+    if limit:
+        query = query.limit(limit)
+    
+    rows = (await db.execute(query)).mappings().all()
+    
+    headers = {}
+    if limit and len(rows) == limit:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1]["id"])
+    
+    return ORJSONResponse([dict(row) for row in rows], headers=headers)
+
+# Declared before /{challenge_id}, which would otherwise match "search"
+@router.get("/search", response_model=List[ChallengeResponse], response_class=ORJSONResponse)
+async def search_challenges(
+    q: str = Query(..., min_length=1, max_length=200),
+    difficulty: Optional[str] = None,
+    global_only: Optional[bool] = False,
+    include_expired: bool = False,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Full-text search over challenge titles and descriptions
+    
+    Every word must match (as a prefix); best matches come first. Pass the
+    X-Next-Cursor header as `cursor` for the next page. Rankings depend on
+    the whole catalog, so pages may shift while challenges are added.
+    """
+    offset = 0
+    if cursor:
+        offset, = decode_cursor(cursor, 1)
+        if not isinstance(offset, int) or offset < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    query = search_query(db.bind.dialect.name, q, FEED_COLUMNS)
+    if query is None:
+        return ORJSONResponse([])
+    if difficulty:
+        query = query.where(Challenge.difficulty == difficulty)
+    if global_only:
+        query = query.where(Challenge.is_global == True)
+    if not include_expired:
+        query = query.where(live_filter())
+    
+    rows = (await db.execute(query.limit(limit).offset(offset))).mappings().all()
+    
+    headers = {}
+    if len(rows) == limit:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(offset + limit)
+    
+    return ORJSONResponse([dict(row) for row in rows], headers=headers)
 
 @router.get("/{challenge_id}", response_model=ChallengeResponse)
-async def get_challenge(challenge_id: str, db: Session = Depends(get_db)):
-    """Get a specific challenge"""
-    challenge = db.query(Challenge).filter(Challenge.id == challenge_id).first()
+async def get_challenge(challenge_id: str, db: AsyncSession = Depends(get_read_db)):
+    """Get a specific challenge, including archived ones"""
+    challenge = await db.get(Challenge, challenge_id) or await db.get(ArchivedChallenge, challenge_id)
     if not challenge:
         raise HTTPException(status_code=404, detail="Challenge not found")
     return challenge
 
 @router.post("/", response_model=ChallengeResponse)
-async def create_challenge(challenge: ChallengeCreate, db: Session = Depends(get_db)):
+async def create_challenge(challenge: ChallengeCreate, db: AsyncSession = Depends(get_async_db)):
     """Create a new challenge"""
     import uuid
     
@@ -119,8 +176,10 @@ async def create_challenge(challenge: ChallengeCreate, db: Session = Depends(get
     )
     
     db.add(db_challenge)
-    db.commit()
-    db.refresh(db_challenge)
+    await db.commit()
+    await db.refresh(db_challenge)
+    
+    publish_changes(paths=["/api/challenges"])
     
     return db_challenge
 
@@ -128,24 +187,9 @@ async def create_challenge(challenge: ChallengeCreate, db: Session = Depends(get
 async def assign_challenge_to_user(
     challenge_id: str,
     user_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Assign a challenge to a user"""
-    challenge = db.query(Challenge).filter(Challenge.id == challenge_id).first()
-    if not challenge:
-        raise HTTPException(status_code=404, detail="Challenge not found")
-    
-    # Check if already assigned
-    existing = db.query(UserChallenge).filter(
-        and_(
-            UserChallenge.user_id == user_id,
-            UserChallenge.challenge_id == challenge_id
-        )
-    ).first()
-    
-    if existing:
-        raise HTTPException(status_code=400, detail="Challenge already assigned to user")
-    
     user_challenge = UserChallenge(
         user_id=user_id,
         challenge_id=challenge_id,
@@ -153,67 +197,186 @@ async def assign_challenge_to_user(
     )
     
     db.add(user_challenge)
+    try:
+        await db.flush()
+    except IntegrityError:
+        # Either the pair already exists (unique index) or, on Postgres,
+        # the challenge does not (foreign key)
+        await db.rollback()
+        if not await db.scalar(select(Challenge.id).where(Challenge.id == challenge_id)):
+            raise HTTPException(status_code=404, detail="Challenge not found")
+        raise HTTPException(status_code=400, detail="Challenge already assigned to user")
     
-    # Update global challenge participants count
-    if challenge.is_global:
-        challenge.participants_count = (challenge.participants_count or 0) + 1
+    # Update global challenge participants count in place, so concurrent
+    # assignments never overwrite each other
+    updated = (await db.execute(
+        update(Challenge)
+        .where(Challenge.id == challenge_id)
+        .values(participants_count=case(
+            (Challenge.is_global == True, func.coalesce(Challenge.participants_count, 0) + 1),
+            else_=Challenge.participants_count
+        ))
+        .returning(Challenge.is_global, Challenge.participants_count, Challenge.completed_count)
+        .execution_options(synchronize_session=False)
+    )).first()
     
-    db.commit()
-    db.refresh(user_challenge)
+    if not updated:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Challenge not found")
+    
+    await db.commit()
+    
+    publish_changes(
+        paths=["/api/challenges"],
+        challenges=[(challenge_id, updated.participants_count, updated.completed_count)] if updated.is_global else (),
+        sticky=[user_id],
+    )
     
     return {"message": "Challenge assigned successfully", "user_challenge_id": user_challenge.id}
 
+# Users per INSERT ... SELECT, well below SQLite's bound parameter limit
+BULK_ASSIGN_CHUNK = 5000
+
+@router.post("/{challenge_id}/assign/bulk", response_model=BulkAssignResponse)
+async def bulk_assign_challenge(
+    challenge_id: str,
+    request: BulkAssignRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Assign a challenge to many users at once
+    
+    Missing pairs are inserted with INSERT ... SELECT ... ON CONFLICT DO
+    NOTHING, so existing assignments and unknown users are skipped, and
+    participants_count grows once by the number of rows actually inserted.
+    """
+    if not await db.scalar(select(Challenge.id).where(Challenge.id == challenge_id)):
+        raise HTTPException(status_code=404, detail="Challenge not found")
+    
+    user_ids = list(dict.fromkeys(request.user_ids))
+    assigned = 0
+    for start in range(0, len(user_ids), BULK_ASSIGN_CHUNK):
+        chunk = user_ids[start:start + BULK_ASSIGN_CHUNK]
+        statement = (
+            dialect_insert(db, UserChallenge)
+            .from_select(
+                ["user_id", "challenge_id"],
+                select(User.id, literal(challenge_id)).where(User.id.in_(chunk))
+            )
+            .on_conflict_do_nothing(index_elements=["user_id", "challenge_id"])
+            .returning(UserChallenge.id)
+        )
+        assigned += len((await db.execute(statement)).all())
+    
+    counters = None
+    if assigned:
+        counters = (await db.execute(
+            update(Challenge)
+            .where(Challenge.id == challenge_id, Challenge.is_global == True)
+            .values(participants_count=func.coalesce(Challenge.participants_count, 0) + assigned)
+            .returning(Challenge.participants_count, Challenge.completed_count)
+            .execution_options(synchronize_session=False)
+        )).first()
+    await db.commit()
+    
+    if assigned:
+        publish_changes(
+            paths=["/api/challenges"],
+            challenges=[(challenge_id, counters.participants_count, counters.completed_count)] if counters else (),
+        )
+    
+    return {
+        "requested": len(request.user_ids),
+        "assigned": assigned,
+        "skipped": len(request.user_ids) - assigned
+    }
+
 @router.put("/{challenge_id}/toggle")
 async def toggle_challenge(
     challenge_id: str,
     user_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Toggle challenge completion status"""
-    user_challenge = db.query(UserChallenge).filter(
-        and_(
+    """Toggle challenge completion status
+    
+    Every counter is updated with a single UPDATE ... RETURNING statement,
+    so concurrent toggles cannot lose updates and row locks are held only
+    until the commit that follows. With TOGGLE_WRITE_BEHIND the toggle is
+    queued instead and written with the next batch.
+    """
+    if toggle_queue.enabled:
+        return await toggle_queue.enqueue(db, user_id, challenge_id)
+    
+    # Lock the row and keep the day of a completion this toggle may undo
+    completed_at = (await db.execute(
+        select(UserChallenge.completed_at)
+        .where(UserChallenge.user_id == user_id, UserChallenge.challenge_id == challenge_id)
+        .with_for_update()
+    )).scalar()
+    now = datetime.now()
+    was_completed = func.coalesce(UserChallenge.completed, False)
+    toggled = (await db.execute(
+        update(UserChallenge)
+        .where(
             UserChallenge.user_id == user_id,
             UserChallenge.challenge_id == challenge_id
         )
-    ).first()
+        .values(
+            completed=not_(was_completed),
+            completed_at=case((was_completed, None), else_=now)
+        )
+        .returning(UserChallenge.completed)
+        .execution_options(synchronize_session=False)
+    )).first()
     
-    if not user_challenge:
+    if not toggled:
+        await db.rollback()
         raise HTTPException(status_code=404, detail="Challenge not found for user")
     
-    challenge = db.query(Challenge).filter(Challenge.id == challenge_id).first()
-    user = db.query(User).filter(User.id == user_id).first()
+    new_completed = bool(toggled.completed)
+    delta = 1 if new_completed else -1
     
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    # Update global challenge stats
+    challenge = (await db.execute(
+        update(Challenge)
+        .where(Challenge.id == challenge_id)
+        .values(completed_count=case(
+            (Challenge.is_global == True, clamped_increment(Challenge.completed_count, delta)),
+            else_=Challenge.completed_count
+        ))
+        .returning(Challenge.id, Challenge.stars, Challenge.is_global, Challenge.participants_count, Challenge.completed_count)
+        .execution_options(synchronize_session=False)
+    )).first()
     
-    # Toggle completion
-    new_completed = not user_challenge.completed
-    user_challenge.completed = new_completed
-    user_challenge.completed_at = datetime.now() if new_completed else None
+    if not challenge:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Challenge not found")
     
     # Update user stats
-    if new_completed:
-        user.completed_challenges += 1
-        user.total_stars += challenge.stars
-    else:
-        user.completed_challenges = max(0, user.completed_challenges - 1)
-        user.total_stars = max(0, user.total_stars - challenge.stars)
-    
-    user.can_publish = user.completed_challenges >= 5
+    completed_challenges = clamped_increment(User.completed_challenges, delta)
+    user = (await db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(
+            completed_challenges=completed_challenges,
+            total_stars=clamped_increment(User.total_stars, delta * challenge.stars),
+            can_publish=completed_challenges >= 5
+        )
+        .returning(User.id, User.name, User.completed_challenges, User.total_stars, User.can_publish)
+        .execution_options(synchronize_session=False)
+    )).first()
     
-    # Update global challenge stats
-    if challenge.is_global:
-        if new_completed:
-            challenge.completed_count = (challenge.completed_count or 0) + 1
-        else:
-            challenge.completed_count = max(0, (challenge.completed_count or 0) - 1)
+    if not user:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
     
-    db.commit()
-    db.refresh(user_challenge)
-    db.refresh(user)
+    await record_completions(db, [
+        (user_id, challenge_id, now if new_completed else completed_at, delta, challenge.stars)
+    ])
+    await db.commit()
+    publish_toggles([user], [challenge])
     
     return {
-        "completed": user_challenge.completed,
+        "completed": new_completed,
         "user_stats": {
             "completed_challenges": user.completed_challenges,
             "total_stars": user.total_stars,
@@ -222,14 +385,61 @@ async def toggle_challenge(
     }
 
 @router.delete("/{challenge_id}")
-async def delete_challenge(challenge_id: str, db: Session = Depends(get_db)):
-    """Delete a challenge"""
-    challenge = db.query(Challenge).filter(Challenge.id == challenge_id).first()
+async def delete_challenge(challenge_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Delete a challenge
+    
+    Users who completed it lose the completion and its stars, so their
+    counters keep matching user_challenges. Rows are locked in the order
+    toggles take them (user_challenges, challenge, users), so a concurrent
+    toggle cannot deadlock with the delete.
+    """
+    completions = [
+        row for row in (await db.execute(
+            select(UserChallenge.user_id, UserChallenge.completed, UserChallenge.completed_at)
+            .where(UserChallenge.challenge_id == challenge_id)
+            .with_for_update()
+        )).all()
+        if row.completed
+    ]
+    challenge = (await db.execute(
+        select(Challenge.stars).where(Challenge.id == challenge_id).with_for_update()
+    )).first()
     if not challenge:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Challenge not found")
+    stars = challenge.stars or 0
+    
+    users = []
+    if completions:
+        completed_challenges = clamped_increment(User.completed_challenges, -1)
+        users = (await db.execute(
+            update(User)
+            .where(User.id.in_({row.user_id for row in completions}))
+            .values(
+                completed_challenges=completed_challenges,
+                total_stars=clamped_increment(User.total_stars, -stars),
+                can_publish=completed_challenges >= 5
+            )
+            .returning(User.id, User.name, User.completed_challenges)
+            .execution_options(synchronize_session=False)
+        )).all()
+    
+    await record_completions(db, [
+        (row.user_id, challenge_id, row.completed_at, -1, stars)
+        for row in completions
+    ], per_challenge=False)
+    await db.execute(delete(ChallengeDailyStats).where(ChallengeDailyStats.challenge_id == challenge_id))
+    await db.execute(delete(UserChallenge).where(UserChallenge.challenge_id == challenge_id))
+    result = await db.execute(delete(Challenge).where(Challenge.id == challenge_id))
+    if not result.rowcount:
+        await db.rollback()
         raise HTTPException(status_code=404, detail="Challenge not found")
     
-    db.delete(challenge)
-    db.commit()
+    await db.commit()
+    
+    stale = ["/api/challenges"] + [f"/api/users/{user.id}" for user in users]
+    if users:
+        stale.append("/api/leaderboard")
+    publish_changes(paths=stale, users=users)
     
     return {"message": "Challenge deleted successfully"}
-
@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+
+from app.events import broadcaster
+from app.metrics import TimedRoute
+
+router = APIRouter(route_class=TimedRoute)
+
+@router.get("/stream")
+async def stream_events():
+    """Server-Sent Events with coalesced global challenge and leaderboard updates
+    
+    Each `update` event carries `challenges` (id, participants_count,
+    completed_count), `users` (id, completed_count) and, when any score
+    changed, the top of the `leaderboard`.
+    """
+    return StreamingResponse(
+        broadcaster.subscribe(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
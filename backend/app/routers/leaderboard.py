@@ -1,57 +1,64 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
-from typing import List
+from fastapi import APIRouter, HTTPException, Query, Response
+from typing import List, Optional
 
-from app.database import get_db
-from app.models import User, UserChallenge
+from app.metrics import TimedRoute
+from app.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from app.rank_index import rank_index, RANK_MODES
 from app.schemas import LeaderboardEntry
+from app.toggles import toggle_queue
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+def check_rank_mode(rank_mode: str):
+    if rank_mode not in RANK_MODES:
+        raise HTTPException(status_code=400, detail="rank_mode must be 'competition' or 'dense'")
 
 @router.get("/", response_model=List[LeaderboardEntry])
-async def get_leaderboard(db: Session = Depends(get_db)):
-    """Get leaderboard sorted by completed challenges"""
-    # Get users with their completed challenge counts
-    results = db.query(
-        User.id,
-        User.name,
-        func.count(UserChallenge.id).label('completed_count')
-    ).join(
-        UserChallenge, User.id == UserChallenge.user_id
-    ).filter(
-        UserChallenge.completed == True
-    ).group_by(
-        User.id, User.name
-    ).order_by(
-        desc('completed_count')
-    ).all()
+async def get_leaderboard(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    around: Optional[str] = None,
+    radius: int = Query(5, ge=0, le=100),
+    rank_mode: str = "competition"
+):
+    """Get leaderboard sorted by completed challenges
     
-    # Build leaderboard entries
-    leaderboard = []
-    for rank, (user_id, name, completed_count) in enumerate(results, start=1):
-        leaderboard.append({
-            "id": user_id,
-            "name": name,
-            "completed_count": completed_count,
-            "rank": rank,
-            "avatar": None
-        })
+    Without a cursor returns the top `limit` users. Pass the X-Next-Cursor
+    header of a page as `cursor` to get the next one. With `around` returns
+    the user and up to `radius` neighbours on each side.
+    """
+    check_rank_mode(rank_mode)
     
-    # Add users with 0 completed challenges at the end
-    users_with_challenges = {r[0] for r in results}
-    all_users = db.query(User).all()
+    if around:
+        await toggle_queue.flush_user(around)
+        entries = rank_index.around(around, radius, mode=rank_mode)
+        if entries is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        return entries
     
-    for user in all_users:
-        if user.id not in users_with_challenges:
-            leaderboard.append({
-                "id": user.id,
-                "name": user.name,
-                "completed_count": 0,
-                "rank": len(leaderboard) + 1,
-                "avatar": None
-            })
+    # Ranks come from the in-memory index, no aggregation over user_challenges
+    if cursor:
+        score, user_id = decode_cursor(cursor, 2)
+        if not isinstance(score, int) or not isinstance(user_id, str):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        entries = rank_index.page_after(score, user_id, limit, mode=rank_mode)
+    else:
+        entries = rank_index.page(0, limit, mode=rank_mode)
     
-    return leaderboard
-
+    if len(entries) == limit:
+        last = entries[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last["completed_count"], last["id"])
+    
+    return entries
 
+@router.get("/rank/{user_id}", response_model=LeaderboardEntry)
+async def get_user_rank(user_id: str, rank_mode: str = "competition"):
+    """Get the leaderboard position of a single user"""
+    check_rank_mode(rank_mode)
+    await toggle_queue.flush_user(user_id)
+    
+    entry = rank_index.rank(user_id, mode=rank_mode)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return entry
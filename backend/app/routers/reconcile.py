@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Depends, Query
+
+from app.admin import require_admin
+from app.metrics import TimedRoute
+from app.reconcile import CHUNK_SIZE, reconcile
+
+router = APIRouter(route_class=TimedRoute, dependencies=[Depends(require_admin)])
+
+@router.post("/")
+async def reconcile_counters(fix: bool = False, chunk_size: int = Query(CHUNK_SIZE, ge=1, le=10000)):
+    """Report drift of denormalized counters, and correct it with fix=true"""
+    return await reconcile(fix, chunk_size)
@@ -0,0 +1,58 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+
+from app.admin import require_admin
+from app.bus import publish_changes
+from app.database import AsyncSessionLocal
+from app.metrics import TimedRoute
+from app.transfer import (
+    CONFLICT_MODES, FORMATS, MEDIA_TYPES,
+    decode_rows, encode_rows, export_rows, get_model, import_rows,
+)
+
+router = APIRouter(route_class=TimedRoute, dependencies=[Depends(require_admin)])
+
+def resolve(table: str, format: str):
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    try:
+        return get_model(table)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.get("/{table}")
+async def export_table(table: str, format: str = "ndjson"):
+    """Stream a whole table (challenges, users or progress) as NDJSON or CSV"""
+    model = resolve(table, format)
+    
+    async def stream():
+        # The session must outlive the handler while the response streams
+        async with AsyncSessionLocal() as db:
+            async for data in encode_rows(export_rows(db, model), model, format):
+                yield data
+    
+    return StreamingResponse(
+        stream(),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'}
+    )
+
+@router.post("/{table}")
+async def import_table(request: Request, table: str, format: str = "ndjson", on_conflict: str = "skip"):
+    """Import rows from an NDJSON or CSV request body in batches"""
+    model = resolve(table, format)
+    if on_conflict not in CONFLICT_MODES:
+        raise HTTPException(status_code=400, detail="on_conflict must be 'skip' or 'update'")
+    
+    async with AsyncSessionLocal() as db:
+        try:
+            result = await import_rows(db, model, decode_rows(request.stream(), format), on_conflict)
+        except (ValueError, KeyError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid row: {e}")
+        except IntegrityError as e:
+            raise HTTPException(status_code=400, detail=f"Conflicting rows: {e.orig}")
+        finally:
+            publish_changes(clear=True)
+    
+    return result
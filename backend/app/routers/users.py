@@ -1,25 +1,63 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
+from datetime import date, timedelta
 
-from app.database import get_db
+from app.bus import publish_changes
+from app.database import get_async_db
+from app.metrics import TimedRoute
 from app.models import User
-from app.schemas import UserCreate, UserResponse
+from app.replicas import get_read_db
+from app.rollups import user_history
+from app.schemas import UserCreate, UserHistoryResponse, UserResponse
+from app.toggles import toggle_queue
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+HISTORY_DAYS = 30
+MAX_HISTORY_DAYS = 366
 
 @router.get("/{user_id}", response_model=UserResponse)
-async def get_user(user_id: str, db: Session = Depends(get_db)):
+async def get_user(user_id: str, db: AsyncSession = Depends(get_read_db)):
     """Get user profile"""
-    user = db.query(User).filter(User.id == user_id).first()
+    await toggle_queue.flush_user(user_id)
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+@router.get("/{user_id}/history", response_model=UserHistoryResponse)
+async def get_user_history(
+    user_id: str,
+    response: Response,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Completions and stars per day, from the daily rollups
+
+    Defaults to the last HISTORY_DAYS days up to today.
+    """
+    if end is None:
+        end = date.today()
+        # The range moves at midnight
+        response.headers["Cache-Control"] = "no-store"
+    if start is None:
+        start = end - timedelta(days=HISTORY_DAYS - 1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days >= MAX_HISTORY_DAYS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_HISTORY_DAYS} days per request")
+    
+    await toggle_queue.flush_user(user_id)
+    if not await db.get(User, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    return await user_history(db, user_id, start, end)
+
 @router.post("/", response_model=UserResponse)
-async def create_user(user: UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Create a new user"""
-    existing_user = db.query(User).filter(User.id == user.id).first()
+    existing_user = await db.get(User, user.id)
     if existing_user:
         return existing_user
     
@@ -32,24 +70,34 @@ async def create_user(user: UserCreate, db: Session = Depends(get_db)):
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    
+    publish_changes(
+        paths=["/api/leaderboard"],
+        users=[(db_user.id, db_user.name, db_user.completed_challenges)],
+        sticky=[db_user.id],
+    )
     
     return db_user
 
 @router.put("/{user_id}", response_model=UserResponse)
-async def update_user(user_id: str, name: Optional[str] = None, db: Session = Depends(get_db)):
+async def update_user(user_id: str, name: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
     """Update user profile"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     if name:
         user.name = name
     
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
+    
+    publish_changes(
+        paths=["/api/leaderboard", f"/api/users/{user_id}"],
+        users=[(user.id, user.name, user.completed_challenges)],
+        sticky=[user.id],
+    )
     
     return user
-
-
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional
+from pydantic import BaseModel, Field
+from datetime import date, datetime
+from typing import List, Optional
 
 class ChallengeBase(BaseModel):
     title: str
@@ -50,6 +50,27 @@ class UserResponse(UserBase):
     class Config:
         from_attributes = True
 
+class DailyStats(BaseModel):
+    day: date
+    completed: int
+    stars: int
+
+class UserHistoryResponse(BaseModel):
+    user_id: str
+    start: date
+    end: date
+    completed: int
+    stars: int
+    days: List[DailyStats]
+
+class BulkAssignRequest(BaseModel):
+    user_ids: List[str] = Field(min_length=1, max_length=100000)
+
+class BulkAssignResponse(BaseModel):
+    requested: int
+    assigned: int
+    skipped: int
+
 class UserChallengeToggle(BaseModel):
     challenge_id: str
     completed: bool
@@ -74,3 +95,11 @@ class AIGenerateResponse(BaseModel):
     difficulty: str
     stars: int
 
+
+class AIBatchRequest(BaseModel):
+    specs: List[AIGenerateRequest] = Field(min_length=1, max_length=200)
+    persist: bool = False
+    # Used only when persist is true
+    is_global: bool = False
+    deadline_days: int = Field(default=7, ge=1, le=365)
+    created_by: Optional[str] = None
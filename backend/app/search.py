@@ -0,0 +1,171 @@
+"""
+Full-text search over challenge titles and descriptions.
+
+SQLite: an FTS5 table, challenges_fts, indexes the challenges table as
+external content (keyed by its rowid). Triggers keep it in sync on
+every insert, delete and title/description update. Results are ranked
+with bm25, title matches weighted above description matches.
+
+Postgres: a generated tsvector column, challenges.search_vector (title
+weight A, description weight B), with a GIN index. Results are ranked
+with ts_rank. SEARCH_TS_CONFIG picks the text search configuration;
+"simple" does no stemming and suits the mixed Russian/English catalog.
+
+Every word of the query must match, as a prefix. Other databases fall
+back to an unindexed LIKE scan.
+
+create_search_index runs from init_db (python -m app.migrations). On
+SQLite it recreates triggers dropped with a recreated challenges table
+and then rebuilds the index. SQLite VACUUM may renumber rowids of the
+challenges table; rebuild the index after one:
+
+    python -m app.search --rebuild
+"""
+import argparse
+import os
+import re
+from typing import Optional
+
+from sqlalchemy import and_, false, func, inspect, literal_column, or_, select, text
+from sqlalchemy.sql import column, table
+
+from app.database import engine
+from app.models import Challenge
+
+SEARCH_TS_CONFIG = os.getenv("SEARCH_TS_CONFIG", "simple")
+# Words of a query beyond this are ignored
+MAX_TERMS = 10
+# bm25 weights of the title and description columns
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+SQLITE_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS challenges_fts USING fts5("
+    "title, description, content='challenges', content_rowid='rowid')"
+)
+# Dropped together with the challenges table, so checked on every start
+SQLITE_TRIGGERS = {
+    "challenges_fts_insert":
+        "CREATE TRIGGER IF NOT EXISTS challenges_fts_insert AFTER INSERT ON challenges BEGIN "
+        "INSERT INTO challenges_fts(rowid, title, description) VALUES (new.rowid, new.title, new.description); "
+        "END",
+    "challenges_fts_delete":
+        "CREATE TRIGGER IF NOT EXISTS challenges_fts_delete AFTER DELETE ON challenges BEGIN "
+        "INSERT INTO challenges_fts(challenges_fts, rowid, title, description) "
+        "VALUES ('delete', old.rowid, old.title, old.description); "
+        "END",
+    "challenges_fts_update":
+        "CREATE TRIGGER IF NOT EXISTS challenges_fts_update AFTER UPDATE OF title, description ON challenges BEGIN "
+        "INSERT INTO challenges_fts(challenges_fts, rowid, title, description) "
+        "VALUES ('delete', old.rowid, old.title, old.description); "
+        "INSERT INTO challenges_fts(rowid, title, description) VALUES (new.rowid, new.title, new.description); "
+        "END",
+}
+SQLITE_REBUILD = "INSERT INTO challenges_fts(challenges_fts) VALUES ('rebuild')"
+
+challenges_fts = table("challenges_fts", column("rowid"))
+
+
+def _ts_config() -> str:
+    if not re.fullmatch(r"\w+", SEARCH_TS_CONFIG):
+        raise ValueError(f"Invalid SEARCH_TS_CONFIG '{SEARCH_TS_CONFIG}'")
+    return SEARCH_TS_CONFIG
+
+
+def create_search_index(bind=engine, rebuild: bool = False):
+    """Create the full-text index of challenges if it is missing"""
+    dialect = bind.dialect.name
+    if dialect == "sqlite":
+        with bind.begin() as conn:
+            existing = set(conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE name = 'challenges_fts' "
+                "OR (type = 'trigger' AND tbl_name = 'challenges')"
+            )).scalars())
+            missing = ({"challenges_fts"} | set(SQLITE_TRIGGERS)) - existing
+            conn.execute(text(SQLITE_TABLE))
+            for statement in SQLITE_TRIGGERS.values():
+                conn.execute(text(statement))
+            # Without its triggers the index missed every change since
+            if missing or rebuild:
+                conn.execute(text(SQLITE_REBUILD))
+                print("Построен полнотекстовый индекс челленджей")
+    elif dialect == "postgresql":
+        columns = {c["name"] for c in inspect(bind).get_columns("challenges")}
+        config = _ts_config()
+        if "search_vector" not in columns:
+            # Adding a stored generated column rewrites the table once
+            with bind.begin() as conn:
+                conn.execute(text(
+                    "ALTER TABLE challenges ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                    f"GENERATED ALWAYS AS (setweight(to_tsvector('{config}', coalesce(title, '')), 'A') || "
+                    f"setweight(to_tsvector('{config}', coalesce(description, '')), 'B')) STORED"
+                ))
+            print("Добавлен столбец challenges.search_vector")
+        # CONCURRENTLY cannot run inside a transaction block
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_challenges_search ON challenges USING GIN (search_vector)"
+            ))
+            if rebuild:
+                conn.execute(text("REINDEX INDEX CONCURRENTLY ix_challenges_search"))
+
+
+def drop_search_index(bind=engine):
+    """Drop the SQLite full-text table, which drop_all does not know about"""
+    if bind.dialect.name == "sqlite":
+        with bind.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS challenges_fts"))
+
+
+def query_terms(q: str) -> list:
+    """Words of a search query, lowercased, without FTS syntax"""
+    return re.findall(r"\w+", q.lower())[:MAX_TERMS]
+
+
+def search_query(dialect: str, q: str, columns) -> Optional[select]:
+    """SELECT of columns for challenges matching q, best matches first
+
+    Returns None when q has no words. Callers add filters and paging.
+    """
+    terms = query_terms(q)
+    if not terms:
+        return None
+    query = select(*columns, false().label("completed"))
+
+    if dialect == "sqlite":
+        match = " ".join(f'"{term}"*' for term in terms)
+        rank = func.bm25(literal_column("challenges_fts"), TITLE_WEIGHT, DESCRIPTION_WEIGHT)
+        return (
+            query
+            .select_from(challenges_fts)
+            .join(Challenge, literal_column("challenges.rowid") == challenges_fts.c.rowid)
+            .where(literal_column("challenges_fts").match(match))
+            .order_by(rank, Challenge.id)
+        )
+
+    if dialect == "postgresql":
+        vector = literal_column("challenges.search_vector")
+        tsquery = func.to_tsquery(
+            literal_column(f"'{_ts_config()}'::regconfig"), " & ".join(f"{term}:*" for term in terms)
+        )
+        return (
+            query
+            .where(vector.op("@@")(tsquery))
+            .order_by(func.ts_rank(vector, tsquery).desc(), Challenge.id)
+        )
+
+    return (
+        query
+        .where(and_(*(
+            or_(Challenge.title.ilike(f"%{term}%"), Challenge.description.ilike(f"%{term}%"))
+            for term in terms
+        )))
+        .order_by(Challenge.created_at, Challenge.id)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create or rebuild the challenge search index")
+    parser.add_argument("--rebuild", action="store_true", help="reindex all challenges")
+    args = parser.parse_args()
+    create_search_index(rebuild=args.rebuild)
@@ -0,0 +1,49 @@
+"""
+Startup configuration and boot timing.
+
+With DB_INIT_ON_STARTUP=false workers skip schema creation and test data
+on boot; run them once per deployment instead:
+
+    python -m app.migrations   # tables and indexes
+    python -m app.init_data    # test global challenges
+
+Every worker prints where its boot time went; GET /health/startup
+returns the same report.
+"""
+from contextlib import contextmanager
+import os
+import time
+from typing import Dict
+
+DB_INIT_ON_STARTUP = os.getenv("DB_INIT_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+
+class StartupTimer:
+    def __init__(self):
+        self.steps: Dict[str, float] = {}
+
+    @contextmanager
+    def step(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[name] = time.perf_counter() - started
+
+    def record(self, name: str, seconds: float):
+        self.steps[name] = seconds
+
+    def report(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "total_ms": round(sum(self.steps.values()) * 1000, 1),
+            "steps_ms": {name: round(seconds * 1000, 1) for name, seconds in self.steps.items()},
+        }
+
+    def print_report(self):
+        report = self.report()
+        steps = ", ".join(f"{name} {ms} мс" for name, ms in report["steps_ms"].items())
+        print(f"Запуск воркера {report['pid']} за {report['total_ms']} мс: {steps}")
+
+
+startup_timer = StartupTimer()
@@ -0,0 +1,410 @@
+"""
+Completion toggles: shared counter SQL and the optional write-behind queue.
+
+With TOGGLE_WRITE_BEHIND=1, PUT /toggle validates the request with one
+read, records the user's target state in memory and in an append-only
+journal, and answers right away. A background flusher applies everything
+queued every TOGGLE_FLUSH_INTERVAL_MS in one transaction. Each touched
+challenge and user gets one UPDATE per flush, however many toggles hit it.
+
+Journal entries hold the target state ("completed = X"), not a flip, so
+replaying a journal after a crash is idempotent. Entries are written
+before the toggle is acknowledged, so a process crash loses nothing.
+The journal is fsynced once per flush, or on every toggle with
+TOGGLE_JOURNAL_FSYNC=always.
+
+Reads of a user with queued toggles (profile, feed, rank) flush the queue
+first, so users always read their own writes.
+"""
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+import glob
+import os
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from fastapi import HTTPException
+from sqlalchemy import case, func, select, tuple_, update
+
+from app.bus import publish_changes
+from app.cache import response_cache
+from app.database import AsyncSessionLocal
+from app.models import Challenge, User, UserChallenge
+from app.replicas import replica_router
+from app.rollups import record_completions
+
+TOGGLE_WRITE_BEHIND = os.getenv("TOGGLE_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+TOGGLE_FLUSH_INTERVAL = int(os.getenv("TOGGLE_FLUSH_INTERVAL_MS", "5")) / 1000
+TOGGLE_BATCH_SIZE = int(os.getenv("TOGGLE_BATCH_SIZE", "2000"))
+TOGGLE_JOURNAL_PATH = os.getenv("TOGGLE_JOURNAL_PATH", "./toggle-journal")
+TOGGLE_JOURNAL_FSYNC = os.getenv("TOGGLE_JOURNAL_FSYNC", "batch")  # batch, always
+
+# Pairs per UPDATE ... WHERE (user_id, challenge_id) IN (...)
+PAIR_CHUNK = 500
+
+Pair = Tuple[str, str]
+
+
+def clamped_increment(column, delta):
+    """SQL expression for max(0, column + delta), evaluated by the database"""
+    value = func.coalesce(column, 0) + delta
+    return case((value < 0, 0), else_=value)
+
+
+def publish_toggles(users, challenges):
+    """Propagate committed toggles to the rank index, cache and live events of every worker"""
+    publish_changes(
+        paths=["/api/challenges", "/api/leaderboard"] + [f"/api/users/{user.id}" for user in users],
+        users=[(user.id, user.name, user.completed_challenges) for user in users],
+        challenges=[
+            (challenge.id, challenge.participants_count, challenge.completed_count)
+            for challenge in challenges if challenge.is_global
+        ],
+        sticky=[user.id for user in users],
+    )
+
+
+async def apply_targets(db, targets: Dict[Pair, bool]):
+    """Set completion states in bulk and adjust counters by the net change
+
+    Rows already in the target state are left alone, which makes this
+    idempotent. Returns the updated user and challenge rows; the caller
+    commits.
+    """
+    now = datetime.now()
+    changed: List[Tuple[str, str, bool]] = []
+    # Completion times of the rows being uncompleted, for the daily rollups
+    undone: Dict[Pair, datetime] = {}
+    for target in (True, False):
+        pairs = [pair for pair, value in targets.items() if value == target]
+        for start in range(0, len(pairs), PAIR_CHUNK):
+            chunk = tuple_(UserChallenge.user_id, UserChallenge.challenge_id).in_(pairs[start:start + PAIR_CHUNK])
+            if not target:
+                undone.update(
+                    ((row.user_id, row.challenge_id), row.completed_at)
+                    for row in (await db.execute(
+                        select(UserChallenge.user_id, UserChallenge.challenge_id, UserChallenge.completed_at)
+                        .where(chunk, UserChallenge.completed == True)
+                        .with_for_update()
+                    )).all()
+                )
+            rows = (await db.execute(
+                update(UserChallenge)
+                .where(
+                    chunk,
+                    func.coalesce(UserChallenge.completed, False) != target
+                )
+                .values(completed=target, completed_at=now if target else None)
+                .returning(UserChallenge.user_id, UserChallenge.challenge_id)
+                .execution_options(synchronize_session=False)
+            )).all()
+            changed.extend((row.user_id, row.challenge_id, target) for row in rows)
+
+    if not changed:
+        return [], []
+
+    stars = dict((await db.execute(
+        select(Challenge.id, Challenge.stars).where(Challenge.id.in_({c for _, c, _ in changed}))
+    )).all())
+
+    await record_completions(db, [
+        (user_id, challenge_id, now if target else undone.get((user_id, challenge_id)),
+         1 if target else -1, stars.get(challenge_id, 0))
+        for user_id, challenge_id, target in changed
+    ])
+
+    challenge_deltas: Dict[str, int] = defaultdict(int)
+    user_deltas: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+    for user_id, challenge_id, target in changed:
+        delta = 1 if target else -1
+        challenge_deltas[challenge_id] += delta
+        user_deltas[user_id][0] += delta
+        user_deltas[user_id][1] += delta * stars.get(challenge_id, 0)
+
+    challenges = []
+    for challenge_id, delta in challenge_deltas.items():
+        if not delta:
+            continue
+        row = (await db.execute(
+            update(Challenge)
+            .where(Challenge.id == challenge_id, Challenge.is_global == True)
+            .values(completed_count=clamped_increment(Challenge.completed_count, delta))
+            .returning(Challenge.id, Challenge.is_global, Challenge.participants_count, Challenge.completed_count)
+            .execution_options(synchronize_session=False)
+        )).first()
+        if row:
+            challenges.append(row)
+
+    users = []
+    for user_id, (count_delta, stars_delta) in user_deltas.items():
+        if not count_delta and not stars_delta:
+            continue
+        completed_challenges = clamped_increment(User.completed_challenges, count_delta)
+        row = (await db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                completed_challenges=completed_challenges,
+                total_stars=clamped_increment(User.total_stars, stars_delta),
+                can_publish=completed_challenges >= 5
+            )
+            .returning(User.id, User.name, User.completed_challenges, User.total_stars, User.can_publish)
+            .execution_options(synchronize_session=False)
+        )).first()
+        if row:
+            users.append(row)
+
+    return users, challenges
+
+
+class PendingToggle:
+    __slots__ = ("target", "base", "stars")
+
+    def __init__(self, target: bool, base: bool, stars: int):
+        self.target = target
+        # Completion state in the database when the toggle was queued
+        self.base = base
+        self.stars = stars
+
+
+class ToggleQueue:
+    def __init__(self, journal_path: str = TOGGLE_JOURNAL_PATH):
+        self.enabled = TOGGLE_WRITE_BEHIND
+        self.journal_base = journal_path
+        self.journal_path = f"{journal_path}.{os.getpid()}.ndjson"
+        self._journal_fd: Optional[int] = None
+        self._pending: Dict[Pair, PendingToggle] = {}
+        self._by_user: Dict[str, set] = defaultdict(set)
+        self._flushes = 0
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def has_pending(self, user_id: str) -> bool:
+        return bool(self._by_user.get(user_id))
+
+    async def enqueue(self, db, user_id: str, challenge_id: str) -> dict:
+        """Queue a toggle and return the projected result"""
+        pair = (user_id, challenge_id)
+        while True:
+            flushes = self._flushes
+            row = (await db.execute(
+                select(
+                    UserChallenge.completed,
+                    Challenge.stars,
+                    User.completed_challenges,
+                    User.total_stars
+                )
+                .select_from(UserChallenge)
+                .join(Challenge, Challenge.id == UserChallenge.challenge_id)
+                .join(User, User.id == UserChallenge.user_id)
+                .where(UserChallenge.user_id == user_id, UserChallenge.challenge_id == challenge_id)
+            )).first()
+            # A flush that committed while reading may have made the row stale
+            if flushes == self._flushes:
+                break
+        if not row:
+            raise HTTPException(status_code=404, detail="Challenge not found for user")
+
+        pending = self._pending.get(pair)
+        base = pending.base if pending else bool(row.completed)
+        target = not (pending.target if pending else base)
+
+        self._write_journal(orjson.dumps({"u": user_id, "c": challenge_id, "t": target}) + b"\n")
+        self._pending[pair] = PendingToggle(target, base, row.stars)
+        self._by_user[user_id].add(pair)
+        self._wakeup.set()
+
+        # Keep cached reads and replicas from hiding the queued write
+        response_cache.invalidate("/api/challenges", "/api/leaderboard", f"/api/users/{user_id}")
+        replica_router.stick([user_id])
+
+        completed_challenges, total_stars = row.completed_challenges or 0, row.total_stars or 0
+        for other in self._by_user[user_id]:
+            entry = self._pending[other]
+            if entry.target != entry.base:
+                delta = 1 if entry.target else -1
+                completed_challenges += delta
+                total_stars += delta * entry.stars
+        completed_challenges, total_stars = max(0, completed_challenges), max(0, total_stars)
+
+        return {
+            "completed": target,
+            "queued": True,
+            "user_stats": {
+                "completed_challenges": completed_challenges,
+                "total_stars": total_stars,
+                "can_publish": completed_challenges >= 5
+            }
+        }
+
+    async def flush_user(self, user_id: str):
+        """Apply queued toggles before serving a read of this user"""
+        if self.has_pending(user_id):
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                if not await self._flush_batch():
+                    # Retried by the flusher after a pause
+                    self._wakeup.set()
+                    return
+
+    async def _flush_batch(self) -> bool:
+        batch = dict(list(self._pending.items())[:TOGGLE_BATCH_SIZE])
+        flushing_path = None
+        if len(batch) == len(self._pending):
+            # Everything queued so far is in this batch: start a fresh journal
+            flushing_path = self._rotate_journal()
+
+        try:
+            async with AsyncSessionLocal() as db:
+                users, challenges = await apply_targets(db, {pair: entry.target for pair, entry in batch.items()})
+                await db.commit()
+        except Exception as e:
+            print(f"Не удалось записать очередь переключений: {e}")
+            if flushing_path:
+                # Journal the batch again, with the latest target of each pair
+                self._write_journal(b"".join(
+                    orjson.dumps({"u": u, "c": c, "t": self._pending[(u, c)].target}) + b"\n"
+                    for u, c in batch
+                ))
+                os.remove(flushing_path)
+            await asyncio.sleep(1)
+            return False
+
+        for pair, entry in batch.items():
+            current = self._pending.get(pair)
+            if current is entry:
+                del self._pending[pair]
+                self._by_user[pair[0]].discard(pair)
+                if not self._by_user[pair[0]]:
+                    del self._by_user[pair[0]]
+            elif current is not None:
+                # Toggled again while flushing: the database now holds entry.target
+                current.base = entry.target
+        self._flushes += 1
+        if flushing_path:
+            os.remove(flushing_path)
+
+        publish_toggles(users, challenges)
+        return True
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await asyncio.sleep(TOGGLE_FLUSH_INTERVAL)
+            await self.flush()
+
+    def _open_journal(self):
+        self._journal_fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+    def _write_journal(self, data: bytes):
+        os.write(self._journal_fd, data)
+        if TOGGLE_JOURNAL_FSYNC == "always":
+            os.fsync(self._journal_fd)
+
+    def _rotate_journal(self) -> str:
+        os.fsync(self._journal_fd)
+        os.close(self._journal_fd)
+        flushing_path = self.journal_path + ".flushing"
+        os.replace(self.journal_path, flushing_path)
+        self._open_journal()
+        return flushing_path
+
+    async def _replay_orphans(self):
+        """Apply journals left behind by processes that are gone
+
+        Runs before this process opens its own journal, so a journal left
+        by an earlier process with the same pid is replayed too.
+        """
+        groups = defaultdict(list)
+        for path in glob.glob(f"{self.journal_base}.*.ndjson*"):
+            pid = path[len(self.journal_base) + 1:].split(".", 1)[0]
+            if pid.isdigit():
+                groups[int(pid)].append(path)
+
+        claimed_count = 0
+        for pid, paths in groups.items():
+            if pid != os.getpid() and _process_alive(pid):
+                continue
+            # Oldest entries first: unfinished replays, then the journal
+            # being flushed, then the live journal
+            paths.sort(key=_journal_age)
+            targets: Dict[Pair, bool] = {}
+            claimed = []
+            for path in paths:
+                # Claim the file atomically so only one worker replays it
+                claimed_count += 1
+                claimed_path = f"{self.journal_path}.replay-{claimed_count:06d}"
+                try:
+                    os.replace(path, claimed_path)
+                except FileNotFoundError:
+                    continue
+                claimed.append(claimed_path)
+                with open(claimed_path, "rb") as journal:
+                    for line in journal:
+                        try:
+                            entry = orjson.loads(line)
+                        except orjson.JSONDecodeError:
+                            # Torn last line of a crashed write
+                            continue
+                        targets[(entry["u"], entry["c"])] = entry["t"]
+
+            if targets:
+                async with AsyncSessionLocal() as db:
+                    users, challenges = await apply_targets(db, targets)
+                    await db.commit()
+                publish_toggles(users, challenges)
+                print(f"Восстановлено переключений из журнала процесса {pid}: {len(targets)}")
+            for path in claimed:
+                os.remove(path)
+
+    async def start(self):
+        if not self.enabled:
+            return
+        await self._replay_orphans()
+        self._open_journal()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        os.fsync(self._journal_fd)
+        os.close(self._journal_fd)
+        self._journal_fd = None
+        if self._pending:
+            # The last flush failed: the next start replays the journal
+            print(f"Журнал переключений сохранен для повтора: {self.journal_path} ({len(self._pending)})")
+            return
+        os.remove(self.journal_path)
+
+
+def _journal_age(path: str):
+    suffix = path.rsplit(".ndjson", 1)[1]
+    if suffix.startswith(".replay-"):
+        return (0, suffix)
+    return (1 if suffix == ".flushing" else 2, suffix)
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+toggle_queue = ToggleQueue()
@@ -0,0 +1,282 @@
+"""
+Streaming bulk import and export of challenges, users and progress.
+
+Rows are read with keyset pagination and written in fixed-size batches, so
+memory stays constant regardless of table size. NDJSON and CSV are
+supported in both directions. Used by /api/transfer and from the command
+line, e.g. to move data between SQLite and Postgres:
+
+    DATABASE_URL=sqlite:///./arena.db python -m app.transfer export users > users.ndjson
+    DATABASE_URL=postgresql://... python -m app.transfer import users users.ndjson
+
+Import challenges and users before progress: user_challenges references both.
+"""
+import argparse
+import asyncio
+import csv
+from datetime import datetime
+import io
+import sys
+from typing import AsyncIterator, Dict, Iterable, List
+
+import orjson
+from sqlalchemy import Boolean, DateTime, Integer, select, text
+from sqlalchemy.exc import IntegrityError
+
+from app.bus import invalidation_bus, publish_changes
+from app.database import AsyncSessionLocal, async_engine, dialect_insert
+from app.models import Challenge, User, UserChallenge
+
+TABLES = {
+    "challenges": Challenge,
+    "users": User,
+    "progress": UserChallenge,
+}
+FORMATS = ("ndjson", "csv")
+CONFLICT_MODES = ("skip", "update")
+CHUNK_SIZE = 1000
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def get_model(table: str):
+    try:
+        return TABLES[table]
+    except KeyError:
+        raise ValueError(f"Unknown table '{table}', expected one of: {', '.join(TABLES)}")
+
+
+def _columns(model):
+    return list(model.__table__.columns)
+
+
+def _coerce(column, value):
+    """Convert a decoded NDJSON/CSV value to the column's Python type"""
+    if value is None or (value == "" and column.nullable and not isinstance(column.type, Boolean)):
+        return None
+    if isinstance(value, str):
+        if isinstance(column.type, DateTime):
+            return datetime.fromisoformat(value)
+        if isinstance(column.type, Boolean):
+            return value.strip().lower() in ("1", "true", "t", "yes")
+        if isinstance(column.type, Integer):
+            return int(value)
+    return value
+
+
+async def export_rows(db, model, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[List[dict]]:
+    """Yield batches of rows as dicts, paging by primary key"""
+    columns = _columns(model)
+    key = model.__table__.primary_key.columns.values()[0]
+    last = None
+    while True:
+        query = select(*columns).order_by(key).limit(chunk_size)
+        if last is not None:
+            query = query.where(key > last)
+        rows = (await db.execute(query)).mappings().all()
+        if not rows:
+            return
+        yield [dict(row) for row in rows]
+        last = rows[-1][key.name]
+        if len(rows) < chunk_size:
+            return
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def encode_rows(batches: AsyncIterator[List[dict]], model, fmt: str) -> AsyncIterator[bytes]:
+    """Encode row batches as NDJSON lines or CSV with a header row"""
+    if fmt == "ndjson":
+        async for batch in batches:
+            yield b"".join(orjson.dumps(row) + b"\n" for row in batch)
+        return
+
+    names = [column.name for column in _columns(model)]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(names)
+    yield buffer.getvalue().encode()
+    async for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_value(row[name]) for name in names] for row in batch)
+        yield buffer.getvalue().encode()
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8") + "\n"
+    if pending:
+        yield pending.decode("utf-8")
+
+
+async def decode_rows(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[dict]:
+    """Parse an NDJSON or CSV byte stream into row dicts"""
+    if fmt == "ndjson":
+        async for line in _iter_lines(chunks):
+            if line.strip():
+                yield orjson.loads(line)
+        return
+
+    header = None
+    record = ""
+    async for line in _iter_lines(chunks):
+        # A record is complete once its quotes are balanced; quoted
+        # fields may contain newlines
+        record += line
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), None)
+        record = ""
+        if not values:
+            continue
+        if header is None:
+            header = values
+        else:
+            yield dict(zip(header, values))
+
+
+async def _insert_batch(db, model, batch: List[dict], on_conflict: str) -> int:
+    table = model.__table__
+    key = table.primary_key.columns.values()[0]
+    statement = dialect_insert(db, model).values(batch)
+    if on_conflict == "update":
+        # Progress rows are matched on their user/challenge pair, whatever their id
+        conflict = ["user_id", "challenge_id"] if model is UserChallenge else [key.name]
+        statement = statement.on_conflict_do_update(
+            index_elements=conflict,
+            set_={
+                name: statement.excluded[name]
+                for name in batch[0] if name != key.name and name not in conflict
+            }
+        )
+    else:
+        statement = statement.on_conflict_do_nothing()
+
+    if model is User:
+        rows = (await db.execute(statement.returning(User.id, User.name, User.completed_challenges))).all()
+        publish_changes(users=[tuple(row) for row in rows])
+        return len(rows)
+    return len((await db.execute(statement.returning(key))).all())
+
+
+async def import_rows(
+    db,
+    model,
+    rows: AsyncIterator[dict],
+    on_conflict: str = "skip",
+    chunk_size: int = CHUNK_SIZE
+) -> Dict[str, int]:
+    """Insert rows in batches, committing each batch
+
+    Existing primary keys (and, for progress, existing user/challenge
+    pairs) are skipped, or updated in place with on_conflict="update".
+    A batch that violates another constraint is rolled back and raises
+    ValueError; earlier batches stay committed.
+    """
+    columns = {column.name: column for column in _columns(model)}
+    received = imported = 0
+    batch: List[dict] = []
+
+    async def flush():
+        nonlocal imported
+        try:
+            imported += await _insert_batch(db, model, batch, on_conflict)
+        except IntegrityError as e:
+            await db.rollback()
+            first = received - len(batch) + 1
+            raise ValueError(f"rows {first}-{received} conflict with existing data: {e.orig}") from e
+        await db.commit()
+        batch.clear()
+
+    async for row in rows:
+        received += 1
+        batch.append({name: _coerce(columns[name], value) for name, value in row.items() if name in columns})
+        if len(batch) >= chunk_size:
+            await flush()
+    if batch:
+        await flush()
+
+    if model is UserChallenge and db.bind.dialect.name == "postgresql":
+        # Explicit ids do not advance the serial sequence
+        await db.execute(text(
+            "SELECT setval(pg_get_serial_sequence('user_challenges', 'id'), "
+            "COALESCE((SELECT MAX(id) FROM user_challenges), 1))"
+        ))
+        await db.commit()
+
+    return {"received": received, "imported": imported, "skipped": received - imported}
+
+
+async def _read_file(file, size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await asyncio.to_thread(file.read, size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def _run_export(table: str, fmt: str, output):
+    model = get_model(table)
+    async with AsyncSessionLocal() as db:
+        async for data in encode_rows(export_rows(db, model), model, fmt):
+            output.write(data)
+    output.flush()
+    await async_engine.dispose()
+
+
+async def _run_import(table: str, fmt: str, source, on_conflict: str):
+    model = get_model(table)
+    # Running workers drop their caches once the import is done
+    await invalidation_bus.start()
+    async with AsyncSessionLocal() as db:
+        try:
+            result = await import_rows(db, model, decode_rows(_read_file(source), fmt), on_conflict)
+        finally:
+            publish_changes(clear=True)
+    await invalidation_bus.close()
+    await async_engine.dispose()
+    print(f"{table}: {result}", file=sys.stderr)
+
+
+def main(argv: Iterable[str] = None):
+    parser = argparse.ArgumentParser(description="Streaming import/export of arena data")
+    parser.add_argument("action", choices=("export", "import"))
+    parser.add_argument("table", choices=tuple(TABLES))
+    parser.add_argument("path", nargs="?", default="-", help="file to read or write, '-' for stdin/stdout")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="defaults to the file extension, else ndjson")
+    parser.add_argument("--on-conflict", choices=CONFLICT_MODES, default="skip")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    if args.action == "export":
+        if args.path == "-":
+            asyncio.run(_run_export(args.table, fmt, sys.stdout.buffer))
+        else:
+            with open(args.path, "wb") as output:
+                asyncio.run(_run_export(args.table, fmt, output))
+    else:
+        if args.path == "-":
+            asyncio.run(_run_import(args.table, fmt, sys.stdin.buffer, args.on_conflict))
+        else:
+            with open(args.path, "rb") as source:
+                asyncio.run(_run_import(args.table, fmt, source, args.on_conflict))
+
+
+if __name__ == "__main__":
+    main()
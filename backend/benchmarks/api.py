@@ -0,0 +1,281 @@
+"""
+Load test of the API hot paths against a database seeded by benchmarks.seed.
+
+    python -m benchmarks.seed --users 100000 --challenges 10000 --reset
+    python -m benchmarks.api --mode inprocess --requests 2000 --concurrency 32
+    python -m benchmarks.api --mode uvicorn --workers 4 --output results/pg.json
+
+"inprocess" drives the ASGI app through httpx without a socket and counts
+SQL statements per request. "uvicorn" starts a real server as a
+subprocess and measures it over HTTP. Only the server is counted there:
+SQL counts are not visible from outside.
+
+Each scenario reports p50/p95/p99 latency, throughput and status codes.
+Results are written as JSON tagged with the git commit and database
+backend; compare two runs with benchmarks.compare.
+"""
+import argparse
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.seed import assigned_challenge, challenge_id, user_id
+
+SCENARIOS = ("leaderboard", "rank", "feed", "toggle", "assign", "ai")
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Workload:
+    """Builds requests for each scenario from the seeded id scheme"""
+
+    def __init__(self, users: int, challenges: int, per_user: int, rng: random.Random):
+        self.users = users
+        self.challenges = challenges
+        self.per_user = per_user
+        self.rng = rng
+        self.assign_challenge = None
+        self.assign_users = iter(())
+
+    def user(self) -> str:
+        return user_id(self.rng.randrange(self.users))
+
+    async def prepare(self, client: httpx.AsyncClient, scenario: str, count: int):
+        if scenario == "assign":
+            # A fresh global challenge, assigned to distinct users
+            response = await client.post("/api/challenges/", json={
+                "title": "Benchmark challenge",
+                "description": "Created by benchmarks.api",
+                "difficulty": "easy",
+                "stars": 3,
+                "deadline": (datetime.now() + timedelta(days=30)).isoformat(),
+                "is_global": True,
+            })
+            response.raise_for_status()
+            self.assign_challenge = response.json()["id"]
+            picks = self.rng.sample(range(self.users), min(count, self.users))
+            self.assign_users = iter(user_id(i) for i in picks)
+
+    def request(self, scenario: str):
+        """Return (method, url, params, json) for one request"""
+        if scenario == "leaderboard":
+            if self.rng.random() < 0.5:
+                return "GET", "/api/leaderboard/", {"limit": 100}, None
+            return "GET", "/api/leaderboard/", {"around": self.user(), "radius": 5}, None
+        if scenario == "rank":
+            return "GET", f"/api/leaderboard/rank/{self.user()}", None, None
+        if scenario == "feed":
+            return "GET", "/api/challenges/", {"user_id": self.user(), "limit": 50}, None
+        if scenario == "toggle":
+            i = self.rng.randrange(self.users)
+            c = assigned_challenge(i, self.rng.randrange(self.per_user), self.challenges)
+            return "PUT", f"/api/challenges/{challenge_id(c)}/toggle", {"user_id": user_id(i)}, None
+        if scenario == "assign":
+            user = next(self.assign_users, None) or self.user()
+            return "POST", f"/api/challenges/{self.assign_challenge}/assign", {"user_id": user}, None
+        if scenario == "ai":
+            difficulty = self.rng.choice(("easy", "medium", "hard"))
+            return "POST", "/api/ai/generate-challenge", None, {"difficulty": difficulty}
+        raise ValueError(f"Unknown scenario '{scenario}'")
+
+
+async def run_scenario(client, workload: Workload, scenario: str, requests: int, concurrency: int,
+                       warmup: int, query_counter=None) -> dict:
+    await workload.prepare(client, scenario, requests + warmup)
+    planned = [workload.request(scenario) for _ in range(requests + warmup)]
+    latencies = []
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(index, method, url, params, body):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, params=params, json=body)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            if index >= warmup:
+                latencies.append(elapsed)
+                statuses[str(status)] += 1
+
+    await asyncio.gather(*(send(i, *planned[i]) for i in range(warmup)))
+    queries_before = query_counter() if query_counter else None
+    started = time.perf_counter()
+    await asyncio.gather(*(send(i, *planned[i]) for i in range(warmup, len(planned))))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "statuses": dict(statuses),
+        "errors": sum(n for status, n in statuses.items() if not status.startswith("2")),
+        "throughput_rps": round(requests / wall, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+    if query_counter:
+        result["queries_per_request"] = round((query_counter() - queries_before) / requests, 2)
+    return result
+
+
+def git_commit() -> dict:
+    def git(*args):
+        return subprocess.run(("git",) + args, cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--", "."))}
+
+
+async def dataset_size(bind) -> dict:
+    from sqlalchemy import func, select
+    from app.models import Challenge, User, UserChallenge
+    async with bind.connect() as conn:
+        return {
+            "users": (await conn.execute(select(func.count()).select_from(User))).scalar(),
+            "challenges": (await conn.execute(select(func.count()).select_from(Challenge))).scalar(),
+            "user_challenges": (await conn.execute(select(func.count()).select_from(UserChallenge))).scalar(),
+        }
+
+
+async def run_inprocess(args, scenarios, workload) -> dict:
+    from sqlalchemy import event
+    import main
+    from app.database import async_engine
+
+    queries = 0
+
+    def count(*_):
+        nonlocal queries
+        queries += 1
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    results = {}
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for scenario in scenarios:
+                results[scenario] = await run_scenario(
+                    client, workload, scenario, args.requests, args.concurrency, args.warmup, lambda: queries
+                )
+                print(f"{scenario:>12}: {results[scenario]}", flush=True)
+        size = await dataset_size(async_engine)
+    return {"results": results, "dataset": size, "backend": async_engine.dialect.name}
+
+
+async def wait_for_server(client: httpx.AsyncClient, process, timeout: float = 300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("uvicorn did not become healthy in time")
+
+
+async def run_uvicorn(args, scenarios, workload) -> dict:
+    from app.database import async_engine
+
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR,
+    )
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+            await wait_for_server(client, process)
+            for scenario in scenarios:
+                results[scenario] = await run_scenario(
+                    client, workload, scenario, args.requests, args.concurrency, args.warmup
+                )
+                print(f"{scenario:>12}: {results[scenario]}", flush=True)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    size = await dataset_size(async_engine)
+    await async_engine.dispose()
+    return {"results": results, "dataset": size, "backend": async_engine.dialect.name}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API hot paths")
+    parser.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=1000, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--no-cache", action="store_true", help="disable the response cache (RESPONSE_CACHE_SIZE=0)")
+    parser.add_argument("--users", type=int, help="seeded users, defaults to the row count")
+    parser.add_argument("--challenges", type=int, help="seeded challenges, defaults to the row count")
+    parser.add_argument("--per-user", type=int, default=10, help="must match benchmarks.seed")
+    parser.add_argument("--random-seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # Keep background jobs and seed data out of the measurements
+    os.environ.setdefault("CHALLENGE_EXPIRY_INTERVAL", "0")
+    if args.no_cache:
+        os.environ["RESPONSE_CACHE_SIZE"] = "0"
+
+    from app.database import engine
+    from app.models import Challenge, User
+    from sqlalchemy import func, select
+    with engine.connect() as conn:
+        users = args.users or conn.execute(select(func.count()).select_from(User)).scalar()
+        challenges = args.challenges or conn.execute(
+            select(func.count()).select_from(Challenge).where(Challenge.id.like("c______"))
+        ).scalar()
+    if not users or not challenges:
+        parser.error("database is empty, seed it with python -m benchmarks.seed first")
+    workload = Workload(users, challenges, args.per_user, random.Random(args.random_seed))
+
+    run = run_inprocess if args.mode == "inprocess" else run_uvicorn
+    report = asyncio.run(run(args, scenarios, workload))
+    report.update({
+        **git_commit(),
+        "mode": args.mode,
+        "workers": args.workers if args.mode == "uvicorn" else None,
+        "response_cache": not args.no_cache,
+        "python": platform.python_version(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+    })
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
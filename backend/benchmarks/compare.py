@@ -0,0 +1,48 @@
+"""
+Compare two benchmarks.api result files, e.g. two commits or SQLite vs Postgres.
+
+    python -m benchmarks.compare results/before.json results/after.json
+"""
+import argparse
+import json
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "queries_per_request")
+
+
+def describe(report: dict) -> str:
+    commit = (report.get("commit") or "unknown")[:10] + ("+dirty" if report.get("dirty") else "")
+    return f"{commit} {report.get('backend')} {report.get('mode')} {report.get('dataset')}"
+
+
+def change(old, new) -> str:
+    if old in (None, 0) or new is None:
+        return ""
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("base")
+    parser.add_argument("head")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+
+    print(f"base: {describe(base)}")
+    print(f"head: {describe(head)}")
+    print(f"{'scenario':<12} {'metric':<20} {'base':>10} {'head':>10} {'change':>9}")
+    for scenario in head["results"]:
+        old_result = base["results"].get(scenario, {})
+        new_result = head["results"][scenario]
+        for metric in METRICS:
+            if metric not in new_result and metric not in old_result:
+                continue
+            old, new = old_result.get(metric), new_result.get(metric)
+            print(f"{scenario:<12} {metric:<20} {str(old):>10} {str(new):>10} {change(old, new):>9}")
+
+
+if __name__ == "__main__":
+    main()
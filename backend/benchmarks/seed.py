@@ -0,0 +1,147 @@
+"""
+Seed the database from DATABASE_URL with synthetic data at scale.
+
+    python -m benchmarks.seed --users 1000000 --challenges 10000 --per-user 10 --reset
+
+The data is deterministic for a given --random-seed, so runs on different
+commits or backends start from the same rows. User u<i> is assigned
+challenges c<(i + j) % challenges> for j < per_user, so benchmarks can
+pick existing assignments without querying for them. Every tenth
+challenge is global. All counters match user_challenges exactly.
+"""
+import argparse
+from datetime import datetime, timedelta
+import random
+import time
+
+from sqlalchemy import func, insert, select, update
+
+from app.database import Base, SessionLocal, engine, init_db
+from app.models import Challenge, User, UserChallenge
+from app.search import drop_search_index
+
+DIFFICULTY_STARS = (("easy", 3), ("medium", 5), ("hard", 8), ("extreme", 10))
+GLOBAL_EVERY = 10
+CHUNK_USERS = 10000
+
+
+def user_id(i: int) -> str:
+    return f"u{i:07d}"
+
+
+def challenge_id(i: int) -> str:
+    return f"c{i:06d}"
+
+
+def assigned_challenge(user: int, j: int, challenges: int) -> int:
+    """Index of the j-th challenge assigned to a seeded user"""
+    return (user + j) % challenges
+
+
+def seed(users: int, challenges: int, per_user: int, completed_ratio: float, random_seed: int = 1):
+    if per_user > challenges:
+        raise ValueError("--per-user cannot exceed --challenges")
+    rng = random.Random(random_seed)
+    now = datetime.now()
+    stars = []
+    started = time.perf_counter()
+
+    with SessionLocal() as db:
+        rows = []
+        for i in range(challenges):
+            difficulty, star_count = DIFFICULTY_STARS[i % len(DIFFICULTY_STARS)]
+            stars.append(star_count)
+            rows.append({
+                "id": challenge_id(i),
+                "title": f"Challenge {i}",
+                "description": "Exercise for at least 30 minutes every day for a month",
+                "difficulty": difficulty,
+                "stars": star_count,
+                "deadline": now + timedelta(days=365),
+                "created_by": None,
+                "is_ai": False,
+                "is_global": i % GLOBAL_EVERY == 0,
+                "participants_count": 0,
+                "completed_count": 0,
+                "created_at": now - timedelta(seconds=challenges - i),
+            })
+        db.execute(insert(Challenge), rows)
+        db.commit()
+
+        participants = [0] * challenges
+        completions = [0] * challenges
+        next_id = 1
+        for start in range(0, users, CHUNK_USERS):
+            user_rows, progress_rows = [], []
+            for i in range(start, min(start + CHUNK_USERS, users)):
+                completed_count = total_stars = 0
+                for j in range(per_user):
+                    c = assigned_challenge(i, j, challenges)
+                    completed = rng.random() < completed_ratio
+                    progress_rows.append({
+                        "id": next_id,
+                        "user_id": user_id(i),
+                        "challenge_id": challenge_id(c),
+                        "completed": completed,
+                        "completed_at": now if completed else None,
+                        "created_at": now,
+                    })
+                    next_id += 1
+                    if c % GLOBAL_EVERY == 0:
+                        participants[c] += 1
+                        completions[c] += completed
+                    if completed:
+                        completed_count += 1
+                        total_stars += stars[c]
+                user_rows.append({
+                    "id": user_id(i),
+                    "name": f"User {i}",
+                    "completed_challenges": completed_count,
+                    "total_stars": total_stars,
+                    "can_publish": completed_count >= 5,
+                    "created_at": now,
+                    "updated_at": now,
+                })
+            db.execute(insert(User), user_rows)
+            if progress_rows:
+                db.execute(insert(UserChallenge), progress_rows)
+            db.commit()
+            print(f"  users {start + len(user_rows)}/{users}, user_challenges {next_id - 1}", flush=True)
+
+        db.execute(update(Challenge), [
+            {"id": challenge_id(c), "participants_count": participants[c], "completed_count": completions[c]}
+            for c in range(challenges) if participants[c]
+        ])
+        db.commit()
+
+        if engine.dialect.name == "postgresql":
+            db.execute(func.setval(func.pg_get_serial_sequence("user_challenges", "id"), next_id).select())
+            db.commit()
+
+    print(f"Seeded {users} users, {challenges} challenges, {next_id - 1} user_challenges "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed synthetic benchmark data into DATABASE_URL")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--challenges", type=int, default=1000)
+    parser.add_argument("--per-user", type=int, default=10, help="challenges assigned to each user")
+    parser.add_argument("--completed-ratio", type=float, default=0.4)
+    parser.add_argument("--random-seed", type=int, default=1)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate all tables first")
+    args = parser.parse_args()
+
+    if args.reset:
+        drop_search_index(engine)
+        Base.metadata.drop_all(bind=engine)
+    init_db()
+    with SessionLocal() as db:
+        if db.execute(select(User.id).limit(1)).first() or db.execute(select(Challenge.id).limit(1)).first():
+            parser.error("database is not empty, pass --reset to drop existing data")
+
+    seed(args.users, args.challenges, args.per_user, args.completed_ratio, args.random_seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,72 @@
+import time
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
-import uvicorn
 import os
 from pathlib import Path
 
-from app.database import init_db
-from app.routers import challenges, users, leaderboard, ai
+from app.ai_generator import challenge_generator
+from app.archive import expiry_scheduler
+from app.assets import Variants, load as load_assets
+from app.bus import invalidation_bus
+from app.cache import ResponseCacheMiddleware
+from app.compression import CompressionMiddleware
+from app.database import init_db, async_engine, engine, get_pool_stats, replica_engines
+from app.events import broadcaster
+from app.metrics import MetricsMiddleware, TimedRoute, instrument_engine, metrics
+from app.rank_index import load_rank_index
+from app.replicas import replica_router
+from app.startup import DB_INIT_ON_STARTUP, startup_timer
+from app.toggles import toggle_queue
+from app.routers import challenges, users, leaderboard, ai, transfer, events, reconcile
+
+startup_timer.record("imports", time.perf_counter() - _import_started)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    init_db()
-    # Initialize test data if needed
-    try:
-        from app.init_data import init_test_data
-        init_test_data()
-    except Exception as e:
-        print(f"Не удалось инициализировать тестовые данные: {e}")
+    if DB_INIT_ON_STARTUP:
+        # Schema and test data; with DB_INIT_ON_STARTUP=false run
+        # python -m app.migrations and python -m app.init_data once per deploy
+        with startup_timer.step("init_db"):
+            init_db()
+        with startup_timer.step("init_data"):
+            try:
+                from app.init_data import init_test_data
+                init_test_data()
+            except Exception as e:
+                print(f"Не удалось инициализировать тестовые данные: {e}")
+    # Listen for other workers' writes before loading anything they could change
+    with startup_timer.step("invalidation_bus"):
+        await invalidation_bus.start()
+    # Build the leaderboard rank index once per process
+    with startup_timer.step("rank_index"):
+        load_rank_index()
+    # Measure replica lag before the first read is routed
+    with startup_timer.step("replicas"):
+        await replica_router.start()
+    # Replay toggles journaled by crashed workers, then start the write-behind flusher
+    with startup_timer.step("toggle_queue"):
+        await toggle_queue.start()
+    # Hide and archive challenges past their deadline
+    expiry_scheduler.start()
+    # Start pre-generating AI challenges in the background
+    with startup_timer.step("ai_warm_up"):
+        challenge_generator.warm_up()
+    startup_timer.print_report()
     yield
     # Shutdown
-    pass
+    await expiry_scheduler.close()
+    await toggle_queue.close()
+    await invalidation_bus.close()
+    await broadcaster.close()
+    await challenge_generator.close()
+    await replica_router.close()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="Win Place Arena API",
@@ -30,6 +74,21 @@ app = FastAPI(
     version="1.0.0",
     lifespan=lifespan
 )
+app.router.route_class = TimedRoute
+
+# Счетчики SQL-запросов и их времени для каждого запроса (см. /metrics)
+instrument_engine(async_engine.sync_engine)
+instrument_engine(engine)
+for replica_engine in replica_engines:
+    instrument_engine(replica_engine.sync_engine)
+
+# Сжатие больших ответов (br/gzip); добавляется первым, чтобы кэш
+# хранил уже сжатые ответы для каждой кодировки
+app.add_middleware(CompressionMiddleware)
+
+# Кэш GET-ответов с ETag; добавляется до CORS, чтобы CORS-заголовки
+# выставлялись для каждого запроса, а не брались из кэша
+app.add_middleware(ResponseCacheMiddleware)
 
 # CORS middleware - разрешаем все для упрощения
 app.add_middleware(
@@ -40,11 +99,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Метрики добавляются последними, чтобы учитывать и ответы из кэша
+app.add_middleware(MetricsMiddleware, router=app.router)
+
 # Include routers
 app.include_router(challenges.router, prefix="/api/challenges", tags=["challenges"])
 app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(leaderboard.router, prefix="/api/leaderboard", tags=["leaderboard"])
 app.include_router(ai.router, prefix="/api/ai", tags=["ai"])
+app.include_router(transfer.router, prefix="/api/transfer", tags=["transfer"])
+app.include_router(events.router, prefix="/api/events", tags=["events"])
+app.include_router(reconcile.router, prefix="/api/reconcile", tags=["reconcile"])
 
 # Статические файлы фронтенда
 # При source_dir: backend фронтенд находится в родительской директории
@@ -53,25 +118,27 @@ if not frontend_path.exists():
     # Fallback: ищем в текущей директории
     frontend_path = Path(__file__).parent / "frontend"
 
-print(f"[DEBUG] Looking for frontend at: {frontend_path}")
-print(f"[DEBUG] Frontend exists: {frontend_path.exists()}")
+# index.html читается один раз при запуске, а не на каждый запрос
+index_path = frontend_path / "index.html"
+index_html = index_path.read_bytes() if index_path.exists() else None
 
 if frontend_path.exists():
-    print(f"[DEBUG] Mounting static files from: {frontend_path}")
     # Раздаем статические файлы (CSS, JS, изображения)
     # Используем общий путь /static для всех файлов из frontend
     app.mount("/static", StaticFiles(directory=str(frontend_path)), name="static")
-    
-    # Главная страница - отдаем index.html
-    @app.get("/")
-    async def root():
-        index_path = frontend_path / "index.html"
-        print(f"[DEBUG] Serving index.html from: {index_path}")
-        if index_path.exists():
-            return FileResponse(str(index_path))
-        return {"message": "Frontend path found but index.html missing", "path": str(index_path)}
+
+# Собранные python -m app.assets файлы с хэшем в имени: /assets, кэшируются навсегда
+asset_files = load_assets(frontend_path)
+if asset_files is not None:
+    app.mount("/assets", asset_files, name="assets")
+    if index_html is not None:
+        index_html = asset_files.rewrite(index_html)
+
+if index_html is not None:
+    # Главная страница - отдаем index.html, заранее сжатый, с ETag
+    app.add_route("/", Variants.compressed(index_html, "text/html; charset=utf-8", b"no-cache"), methods=["GET", "HEAD"])
 else:
-    print(f"[DEBUG] Frontend not found at: {frontend_path}")
+    print(f"Фронтенд не найден: {index_path}")
     @app.get("/")
     async def root():
         return {"message": "Win Place Arena API", "version": "1.0.0", "frontend_path": str(frontend_path)}
@@ -80,6 +147,37 @@ else:
 async def health():
     return {"status": "ok"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus histograms of latency, SQL count and time per route, for this worker"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/startup")
+async def startup_health():
+    """Where this worker's boot time went"""
+    return startup_timer.report()
+
+@app.get("/health/bus")
+async def bus_health():
+    """Cross-worker invalidation events sent and received by this worker"""
+    return {"pid": os.getpid(), **invalidation_bus.stats()}
+
+@app.get("/health/pool")
+async def pool_health():
+    """Connection pool usage of this worker, for sizing against uvicorn workers"""
+    return {
+        "pid": os.getpid(),
+        "async": get_pool_stats(async_engine),
+        "sync": get_pool_stats(engine),
+        "replicas": [get_pool_stats(replica_engine) for replica_engine in replica_engines],
+    }
+
+@app.get("/health/replicas")
+async def replicas_health():
+    """Lag and read counts of the read replicas, as seen by this worker"""
+    return {"pid": os.getpid(), "enabled": replica_router.enabled, **replica_router.stats()}
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
 
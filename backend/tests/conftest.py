@@ -0,0 +1,24 @@
+"""
+Test settings. The app reads its configuration at import time, so the
+environment is set here, before any test module imports it.
+"""
+import os
+import sys
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix="winplacearena-tests-")
+PRIMARY_PATH = os.path.join(DATA_DIR, "primary.db")
+REPLICA_PATHS = [os.path.join(DATA_DIR, f"replica{n}.db") for n in (1, 2)]
+
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{PRIMARY_PATH}",
+    DATABASE_REPLICA_URLS=",".join(f"sqlite:///{path}" for path in REPLICA_PATHS),
+    REPLICA_MAX_LAG_SECONDS="0.2",
+    REPLICA_CHECK_INTERVAL="0.2",
+    INVALIDATION_BUS="off",
+    CHALLENGE_EXPIRY_INTERVAL="0",
+    TOGGLE_WRITE_BEHIND="",
+)
+os.environ.pop("OPENAI_API_KEY", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
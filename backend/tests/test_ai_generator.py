@@ -0,0 +1,152 @@
+"""
+The challenge generator against a local stub of the OpenAI chat completions API.
+"""
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import pytest
+
+from app import ai_generator
+from app.ai_generator import FALLBACK_CHALLENGES, ChallengeGenerator
+
+FALLBACK_TITLES = {challenge["title"] for challenge in FALLBACK_CHALLENGES}
+
+
+class StubOpenAI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.delay = 0.05
+        # Message content of the replies; None for a numbered challenge
+        self.content = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers["Content-Length"]))
+        with server.lock:
+            server.calls += 1
+            number = server.calls
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+
+        content = server.content or json.dumps(
+            {"title": f"Stub challenge {number}", "description": "From the stub", "difficulty": "easy"}
+        )
+        body = json.dumps({
+            "id": f"chatcmpl-{number}",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "stub",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = StubOpenAI()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_BASE_URL", server.url)
+    monkeypatch.setattr(ai_generator, "AI_MAX_RETRIES", 0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run(scenario):
+    """Run a scenario with a fresh generator and close it afterwards"""
+    async def main():
+        generator = ChallengeGenerator(pool_size=3)
+        try:
+            return await scenario(generator)
+        finally:
+            await generator.close()
+    return asyncio.run(main())
+
+
+def test_cold_get_takes_the_refills_first_challenge(stub):
+    async def scenario(generator):
+        challenge = await generator.get("easy", "fitness")
+        await generator._pools[("easy", "fitness")].refill_task
+        return challenge, len(generator._pools[("easy", "fitness")].items)
+
+    challenge, pooled = run(scenario)
+    assert challenge["title"] == "Stub challenge 1"
+    assert challenge["stars"] == 3
+    # The refill topped the pool up again after the first challenge was taken
+    assert pooled == 3
+    assert stub.calls == 4
+
+
+def test_pooled_get_makes_no_call(stub):
+    async def scenario(generator):
+        await generator.get("easy", "fitness")
+        await generator._pools[("easy", "fitness")].refill_task
+        calls = stub.calls
+        challenges = [await generator.get("easy", "fitness") for _ in range(2)]
+        return calls, challenges
+
+    calls, challenges = run(scenario)
+    assert [challenge["title"] for challenge in challenges] == ["Stub challenge 2", "Stub challenge 3"]
+    assert stub.calls == calls
+
+
+def test_concurrent_cold_gets_wait_for_one_refill(stub):
+    stub.delay = 0.2
+
+    async def scenario(generator):
+        return await asyncio.gather(*(generator.get("hard", "music") for _ in range(5)))
+
+    challenges = run(scenario)
+    assert {challenge["title"] for challenge in challenges} == {"Stub challenge 1"}
+    # Only the refill called the API, one request at a time
+    assert stub.max_in_flight == 1
+
+
+def test_slow_api_falls_back_to_a_template(stub, monkeypatch):
+    stub.delay = 2
+    monkeypatch.setattr(ai_generator, "AI_TIMEOUT", 0.2)
+
+    started = time.monotonic()
+    challenge = run(lambda generator: generator.get("medium", "travel"))
+    assert challenge["title"] in FALLBACK_TITLES
+    assert time.monotonic() - started < 1.5
+
+
+def test_malformed_reply_falls_back_to_a_template(stub):
+    stub.content = json.dumps({"title": 42, "difficulty": "easy"})
+
+    challenge = run(lambda generator: generator.get("easy", "food"))
+    assert challenge["title"] in FALLBACK_TITLES
+    assert isinstance(challenge["description"], str)
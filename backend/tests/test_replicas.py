@@ -0,0 +1,113 @@
+"""
+Read routing against a primary and two SQLite replicas.
+
+The replicas are copies of the primary in which the users are renamed
+"replica1" and "replica2", so every profile read shows where it was served.
+"""
+import shutil
+import sqlite3
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from app import replicas
+from app.cache import response_cache
+from app.database import create_replica_engine, engine, init_db
+from app.init_data import init_test_data
+from app.replicas import ReplicaRouter, replica_router
+from conftest import PRIMARY_PATH, REPLICA_PATHS
+
+USERS = ("reader", "assignee", "toggler")
+
+
+@pytest.fixture(scope="module")
+def client():
+    init_db()
+    init_test_data()
+    with engine.begin() as conn:
+        for user_id in USERS:
+            conn.execute(
+                text("INSERT INTO users (id, name, completed_challenges, total_stars, can_publish) "
+                     "VALUES (:id, 'primary', 0, 0, 0)"),
+                {"id": user_id},
+            )
+        conn.execute(text(
+            "INSERT INTO user_challenges (user_id, challenge_id, completed) VALUES ('toggler', 'g1', 0)"
+        ))
+    engine.dispose()
+    primary = sqlite3.connect(PRIMARY_PATH)
+    primary.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    primary.close()
+    for number, path in enumerate(REPLICA_PATHS, 1):
+        shutil.copy(PRIMARY_PATH, path)
+        replica = sqlite3.connect(path)
+        replica.execute("UPDATE users SET name = ?", (f"replica{number}",))
+        replica.commit()
+        replica.close()
+
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+def read_name(client, user_id: str) -> str:
+    response_cache.clear()
+    response = client.get(f"/api/users/{user_id}")
+    assert response.status_code == 200, response.text
+    return response.json()["name"]
+
+
+def test_reads_rotate_across_replicas(client):
+    assert all(replica.available for replica in replica_router.replicas)
+    names = [read_name(client, "reader") for _ in range(4)]
+    assert sorted(names) == ["replica1", "replica1", "replica2", "replica2"]
+    assert names[0] != names[1]
+
+
+def test_broken_replica_leaves_rotation(client):
+    router = ReplicaRouter([
+        create_replica_engine(f"sqlite:///{REPLICA_PATHS[0]}"),
+        create_replica_engine("sqlite:////nonexistent/replica.db"),
+    ])
+    client.portal.call(router.check)
+    working, broken = router.replicas
+    assert working.available and not broken.available and broken.error
+    assert {router.choose() for _ in range(4)} == {working}
+
+    # Its checks now fail too: reads fall back to the primary
+    client.portal.call(working.bind.dispose)
+    working.bind = broken.bind
+    client.portal.call(router.check)
+    assert router.choose() is None
+    client.portal.call(router.close)
+
+
+def test_all_replicas_down_reads_primary(client, monkeypatch):
+    router = ReplicaRouter([create_replica_engine("sqlite:////nonexistent/replica.db")])
+    client.portal.call(router.check)
+    monkeypatch.setattr(replicas, "replica_router", router)
+    assert read_name(client, "reader") == "primary"
+    assert router.primary_reads == 1
+    client.portal.call(router.close)
+
+
+def test_assign_sticks_user_to_primary(client):
+    assert not replica_router.is_sticky("assignee")
+    response = client.post("/api/challenges/g2/assign", params={"user_id": "assignee"})
+    assert response.status_code == 200, response.text
+    assert replica_router.is_sticky("assignee")
+    assert read_name(client, "assignee") == "primary"
+
+    time.sleep(replica_router.sticky_seconds + 0.1)
+    assert not replica_router.is_sticky("assignee")
+    assert read_name(client, "assignee").startswith("replica")
+
+
+def test_toggle_sticks_user_to_primary(client):
+    assert read_name(client, "toggler").startswith("replica")
+    response = client.put("/api/challenges/g1/toggle", params={"user_id": "toggler"})
+    assert response.status_code == 200, response.text
+    assert replica_router.is_sticky("toggler")
+    assert read_name(client, "toggler") == "primary"
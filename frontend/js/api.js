@@ -96,8 +96,19 @@ class ApiClient {
     }
 
     // Leaderboard
-    async getLeaderboard() {
-        return this.request('/api/leaderboard/');
+    async getLeaderboard(limit) {
+        const params = new URLSearchParams();
+        if (limit) params.append('limit', limit);
+        return this.request(`/api/leaderboard/?${params.toString()}`);
+    }
+
+    async getLeaderboardRank(userId) {
+        return this.request(`/api/leaderboard/rank/${userId}`);
+    }
+
+    // Server-Sent Events
+    eventsUrl() {
+        return `${this.baseUrl}/api/events/stream`;
     }
 
     // AI
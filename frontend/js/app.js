@@ -24,9 +24,49 @@ class App {
     async init() {
         await this.loadProfile();
         this.setupEventListeners();
+        this.subscribeToUpdates();
         this.loadTab(this.currentTab);
     }
 
+    // Живые обновления счетчиков и таблицы лидеров вместо повторных запросов
+    subscribeToUpdates() {
+        if (!window.EventSource) return;
+        const source = new EventSource(api.eventsUrl());
+        source.addEventListener('update', (event) => {
+            this.applyUpdate(JSON.parse(event.data));
+        });
+    }
+
+    applyUpdate(update) {
+        (update.challenges || []).forEach(change => {
+            const challenge = this.globalChallenges.find(c => c.id === change.id);
+            if (challenge) {
+                challenge.participants_count = change.participants_count;
+                challenge.completed_count = change.completed_count;
+            }
+        });
+        if (update.leaderboard) {
+            this.mergeLeaderboard(update.leaderboard);
+        }
+        if (this.currentTab === 'arena' && (update.challenges || update.leaderboard)) {
+            this.renderArena();
+        }
+    }
+
+    mergeLeaderboard(top) {
+        // Live updates carry only the top entries: keep the rest of the
+        // loaded list and renumber it after the new top
+        const ids = new Set(top.map(entry => entry.id));
+        const rest = this.leaderboard.filter(entry => !ids.has(entry.id));
+        const merged = top.concat(rest).slice(0, Math.max(this.leaderboard.length, top.length));
+        for (let i = top.length; i < merged.length; i++) {
+            const previous = merged[i - 1];
+            const rank = previous.completed_count === merged[i].completed_count ? previous.rank : i + 1;
+            merged[i] = { ...merged[i], rank };
+        }
+        this.leaderboard = merged;
+    }
+
     async loadProfile() {
         try {
             this.profile = await api.getUser(this.currentUserId);
@@ -284,6 +324,14 @@ class App {
             await this.loadProfile();
         }
 
+        // Позиция в рейтинге - один запрос вместо всей таблицы лидеров
+        let rank = null;
+        try {
+            rank = (await api.getLeaderboardRank(this.currentUserId)).rank;
+        } catch (error) {
+            console.error('Failed to load rank:', error);
+        }
+
         container.innerHTML = `
             <h2>Profile</h2>
             <div class="profile-stats">
@@ -295,6 +343,10 @@ class App {
                     <div class="stat-value">${this.profile.total_stars || 0}</div>
                     <div class="stat-label">Stars</div>
                 </div>
+                <div class="stat-card">
+                    <div class="stat-value">${rank ? '#' + rank : '-'}</div>
+                    <div class="stat-label">Rank</div>
+                </div>
             </div>
             <div style="margin-top: 20px;">
                 <p><strong>User ID:</strong> ${this.currentUserId}</p>